@@ -1,24 +1,30 @@
 # base_agent.py
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, Dict, List
 from models.llms import OllamaModel, OpenAIModel, ClaudeModel
 from utils.config_loader import config
 from utils.logger import get_logger
 logger = get_logger(__name__)
 
 class BaseAgent(ABC):
+    response_schema = None
+
     def __init__(self, model_type: str = 'openai', model_name: str = None):
         self.model_type = model_type
         self.model_name = model_name or config.get(f'{model_type}_model_name')
         self.llm = self._get_llm()
 
     def _get_llm(self):
+        return self.create_llm(self.response_schema)
+
+    def create_llm(self, response_schema: Dict = None):
+        # A client of the same model for a different answer structure
         if self.model_type == 'ollama':
-            return OllamaModel(model=self.model_name)
+            return OllamaModel(model=self.model_name, response_schema=response_schema)
         elif self.model_type == 'openai':
-            return OpenAIModel(model=self.model_name)
+            return OpenAIModel(model=self.model_name, response_schema=response_schema)
         elif self.model_type == 'claude':
-            return ClaudeModel(model=self.model_name)
+            return ClaudeModel(model=self.model_name, response_schema=response_schema)
         else:
             raise ValueError(f"Unsupported model type: {self.model_type}")
 
@@ -30,13 +36,17 @@ class BaseAgent(ABC):
     def process_response(self, response: str) -> Dict[str, Any]:
         pass
 
-    def invoke(self, context: str, query: str) -> Dict[str, Any]:
+    def build_messages(self, context: str, query: str) -> List[Dict[str, str]]:
         prompt = self.get_prompt(context, query)
-        messages = [
+        return [
             {"role": "system", "content": prompt},
             {"role": "user", "content": query}
         ]
 
+    def invoke(self, context: str, query: str) -> Dict[str, Any]:
+        return self.invoke_messages(self.build_messages(context, query))
+
+    def invoke_messages(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
         try:
             response = self.llm.invoke(messages)
             return self.process_response(response)
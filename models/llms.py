@@ -1,41 +1,137 @@
 # llms.py
 import requests
 import json
+import math
 import os
-from typing import List, Dict
+import threading
+import time
+from typing import Callable, List, Dict
 from utils.config_loader import config
 from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
+from utils.json_parser import extract_json_object, JsonObjectScanner
 from utils.logger import get_logger
 logger = get_logger(__name__)
 
 class BaseModel:
-    def __init__(self, temperature: float, model: str, json_response: bool, max_retries: int = 3, retry_delay: int = 1):
+    def __init__(self, temperature: float, model: str, json_response: bool, max_retries: int = 3, retry_delay: int = 1,
+                 response_schema: Dict = None, structured_output: bool = False, streaming: bool = True,
+                 max_output_tokens: int = 512):
         self.temperature = temperature
         self.model = model
         self.json_response = json_response
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        # Providers that can enforce a JSON schema get it when structured output is enabled
+        self.response_schema = response_schema if structured_output else None
+        self.streaming = streaming
+        self.max_output_tokens = max_output_tokens
+        # The read timeout bounds the wait for each chunk, so a stalled stream cannot hold a worker forever
+        self.timeout = (config.get('llm_connect_timeout', 10), config.get('llm_read_timeout', 120))
+        # Called with the input and output token counts the provider reports for every request
+        self.usage_callback = None
+        self.timings = {'calls': 0, 'first_token': 0.0, 'generation': 0.0, 'stopped_early': 0}
+        self._timing_lock = threading.Lock()
+
+    def _record_usage(self, input_tokens, output_tokens):
+        if self.usage_callback:
+            self.usage_callback(input_tokens or 0, output_tokens or 0)
+
+    def _record_timing(self, first_token: float, generation: float, stopped_early: bool):
+        logger.debug("%s: first token after %.3fs, generation took %.3fs%s", self.model, first_token, generation,
+                     " (stopped at the end of the JSON object)" if stopped_early else "")
+        with self._timing_lock:
+            self.timings['calls'] += 1
+            self.timings['first_token'] += first_token
+            self.timings['generation'] += generation
+            self.timings['stopped_early'] += int(stopped_early)
+
+    def timing_summary(self) -> str:
+        with self._timing_lock:
+            calls = self.timings['calls']
+            if not calls:
+                return "no streamed model calls"
+            return (f"{calls} streamed calls, mean time to first token {self.timings['first_token'] / calls:.2f}s, "
+                    f"mean generation time {self.timings['generation'] / calls:.2f}s, "
+                    f"{self.timings['stopped_early']} stopped at the end of the JSON object")
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        return math.ceil(len(text) / 4)
+
+    def _normalize_json(self, content: str) -> str:
+        # Models sometimes wrap the object in prose or code fences; hand back the raw text if nothing parses
+        try:
+            return json.dumps(extract_json_object(content))
+        except ValueError:
+            logger.warning("Could not extract a JSON object from the model response")
+            return content
 
     @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), retry=retry_if_exception_type(requests.RequestException))
     def _make_request(self, url, headers, payload):
-        response = requests.post(url, headers=headers, json=payload)
+        response = requests.post(url, headers=headers, json=payload, timeout=self.timeout)
         response.raise_for_status()
         return response.json()
-    
+
+    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), retry=retry_if_exception_type(requests.RequestException))
+    def _open_stream(self, url, headers, payload):
+        response = requests.post(url, headers=headers, json=payload, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def _stream_request(self, url, headers, payload, parse_event: Callable[[Dict, Dict], str],
+                        messages: List[Dict[str, str]]) -> str:
+        # parse_event returns the text of one streamed event and fills in the usage the provider reports
+        scanner = JsonObjectScanner() if self.json_response else None
+        usage = {}
+        parts = []
+        first_token = None
+        stopped_early = False
+        started = time.perf_counter()
+        with self._open_stream(url, headers, payload) as response:
+            for line in response.iter_lines():
+                line = line.decode('utf-8').strip()
+                if line.startswith('data:'):
+                    line = line[5:].strip()
+                if not line or line.startswith('event:') or line == '[DONE]':
+                    continue
+                delta = parse_event(json.loads(line), usage)
+                if not delta:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                parts.append(delta)
+                # Closing the connection once the object is complete cancels the rest of the generation
+                if scanner and scanner.feed(delta):
+                    stopped_early = True
+                    break
+        generation = time.perf_counter() - started
+        self._record_timing(first_token if first_token is not None else generation, generation, stopped_early)
+        text = ''.join(parts)
+        # Usage normally arrives with the last event, which an early stop never reads
+        self._record_usage(
+            usage.get('input') or sum(self._estimate_tokens(message['content']) for message in messages),
+            usage.get('output') if not stopped_early and usage.get('output') else self._estimate_tokens(text)
+        )
+        return text
+
 
 class OllamaModel(BaseModel):
-    def __init__(self, model: str = None):
+    def __init__(self, model: str = None, response_schema: Dict = None):
         super().__init__(
             temperature=config.get('ollama_temperature', 0),
             model=model or config['ollama_model_name'],
             json_response=config.get('ollama_json_response', False),
             max_retries=config.get('ollama_max_retries', 3),
-            retry_delay=config.get('ollama_retry_delay', 1)
+            retry_delay=config.get('ollama_retry_delay', 1),
+            response_schema=response_schema,
+            structured_output=config.get('ollama_structured_output', False),
+            streaming=config.get('ollama_streaming', True),
+            max_output_tokens=config.get('ollama_max_output_tokens', 512)
         )
         self.headers = {"Content-Type": "application/json"}
         self.model_endpoint = config.get('ollama_model_endpoint', "http://localhost:11434/api/generate")
 
-    def invoke(self, messages: List[Dict[str, str]]) -> str:
+    def invoke(self, messages: List[Dict[str, str]], max_output_tokens: int = None) -> str:
         system = messages[0]["content"]
         user = messages[1]["content"]
 
@@ -43,38 +139,61 @@ class OllamaModel(BaseModel):
             "model": self.model,
             "prompt": user,
             "system": system,
-            "stream": False,
-            "temperature": self.temperature,
+            "stream": self.streaming,
+            # Ollama reads sampling settings from options only
+            "options": {"temperature": self.temperature, "num_predict": max_output_tokens or self.max_output_tokens},
         }
 
-        if self.json_response:
+        if self.response_schema:
+            payload["format"] = self.response_schema
+        elif self.json_response:
             payload["format"] = "json"
         
         try:
-            request_response_json = self._make_request(self.model_endpoint, self.headers, payload)
+            if self.streaming:
+                text = self._stream_request(self.model_endpoint, self.headers, payload, self._stream_event, messages)
+            else:
+                request_response_json = self._make_request(self.model_endpoint, self.headers, payload)
+                self._record_usage(request_response_json.get('prompt_eval_count'), request_response_json.get('eval_count'))
+                text = str(request_response_json['response'])
             
             if self.json_response:
-                response = json.dumps(json.loads(request_response_json['response']))
+                response = self._normalize_json(text)
             else:
-                response = str(request_response_json['response'])
+                response = text
 
             return response
         except requests.RequestException as e:
             logger.error(f"Error in invoking Ollama model: {str(e)}")
             return json.dumps({"error": f"Error in invoking model: {str(e)}"})
-        except json.JSONDecodeError as e:
+        except (ValueError, KeyError) as e:
             logger.error(f"Error processing Ollama response: {str(e)}")
             return json.dumps({"error": f"Error processing response: {str(e)}"})
+
+    @staticmethod
+    def _stream_event(event: Dict, usage: Dict) -> str:
+        if 'error' in event:
+            raise ValueError(event['error'])
+        if event.get('done'):
+            usage['input'] = event.get('prompt_eval_count')
+            usage['output'] = event.get('eval_count')
+        return event.get('response', '')
         
 
 class ClaudeModel(BaseModel):
-    def __init__(self, model: str = None):
+    TOOL_NAME = "record_response"
+
+    def __init__(self, model: str = None, response_schema: Dict = None):
         super().__init__(
             temperature=config.get('claude_temperature', 0),
             model=model or config['claude_model_name'],
             json_response=config.get('claude_json_response', False),
             max_retries=config.get('claude_max_retries', 3),
-            retry_delay=config.get('claude_retry_delay', 1)
+            retry_delay=config.get('claude_retry_delay', 1),
+            response_schema=response_schema,
+            structured_output=config.get('claude_structured_output', False),
+            streaming=config.get('claude_streaming', True),
+            max_output_tokens=config.get('claude_max_output_tokens', 512)
         )
         self.api_key = config.get('ANTHROPIC_API_KEY')
         if not self.api_key:
@@ -86,7 +205,7 @@ class ClaudeModel(BaseModel):
         }
         self.model_endpoint = "https://api.anthropic.com/v1/messages"
 
-    def invoke(self, messages: List[Dict[str, str]]) -> str:
+    def invoke(self, messages: List[Dict[str, str]], max_output_tokens: int = None) -> str:
         system = messages[0]["content"]
         user = messages[1]["content"]
 
@@ -102,20 +221,45 @@ class ClaudeModel(BaseModel):
                     "content": content
                 }
             ],
-            "max_tokens": 4096,
+            "max_tokens": max_output_tokens or self.max_output_tokens,
             "temperature": self.temperature,
+            "stream": self.streaming,
         }
 
+        if self.response_schema:
+            # Forcing a single tool call makes Claude return arguments that follow the schema
+            payload["tools"] = [{
+                "name": self.TOOL_NAME,
+                "description": "Record the result in the required JSON structure.",
+                "input_schema": self.response_schema
+            }]
+            payload["tool_choice"] = {"type": "tool", "name": self.TOOL_NAME}
+
         try:
+            if self.streaming:
+                # Tool arguments stream as JSON fragments, so both modes end in the same text handling
+                response_content = self._stream_request(self.model_endpoint, self.headers, payload, self._stream_event, messages)
+                if not response_content:
+                    raise ValueError("No content in response")
+                if self.json_response or self.response_schema:
+                    return self._normalize_json(response_content)
+                return response_content
+
             response_json = self._make_request(self.model_endpoint, self.headers, payload)
+            usage = response_json.get('usage', {})
+            self._record_usage(usage.get('input_tokens'), usage.get('output_tokens'))
             
             if 'content' not in response_json or not response_json['content']:
                 raise ValueError("No content in response")
 
+            for block in response_json['content']:
+                if block.get('type') == 'tool_use':
+                    return json.dumps(block['input'])
+
             response_content = response_json['content'][0]['text']
             
             if self.json_response:
-                return json.dumps(json.loads(response_content))
+                return self._normalize_json(response_content)
             else:
                 return response_content
 
@@ -126,15 +270,33 @@ class ClaudeModel(BaseModel):
             logger.error(f"Error processing Claude response: {str(e)}")
             return json.dumps({"error": f"Error processing response: {str(e)}"})
 
+    @staticmethod
+    def _stream_event(event: Dict, usage: Dict) -> str:
+        event_type = event.get('type')
+        if event_type == 'error':
+            raise ValueError(event['error'].get('message', event['error']))
+        if event_type == 'message_start':
+            usage['input'] = event['message'].get('usage', {}).get('input_tokens')
+        elif event_type == 'message_delta':
+            usage['output'] = event.get('usage', {}).get('output_tokens')
+        elif event_type == 'content_block_delta':
+            delta = event['delta']
+            return delta.get('text') or delta.get('partial_json') or ''
+        return ''
+
 
 class OpenAIModel(BaseModel):
-    def __init__(self, model: str = None):
+    def __init__(self, model: str = None, response_schema: Dict = None):
         super().__init__(
             temperature=config.get('openai_temperature', 0),
             model=model or config['openai_model_name'],
             json_response=config.get('openai_json_response', False),
             max_retries=config.get('openai_max_retries', 3),
-            retry_delay=config.get('openai_retry_delay', 1)
+            retry_delay=config.get('openai_retry_delay', 1),
+            response_schema=response_schema,
+            structured_output=config.get('openai_structured_output', False),
+            streaming=config.get('openai_streaming', True),
+            max_output_tokens=config.get('openai_max_output_tokens', 512)
         )
         self.model_endpoint = 'https://api.openai.com/v1/chat/completions'
         self.api_key = config.get('OPENAI_API_KEY')
@@ -145,28 +307,54 @@ class OpenAIModel(BaseModel):
             'Authorization': f'Bearer {self.api_key}'
         }
 
-    def invoke(self, messages: List[Dict[str, str]]) -> str:
+    def invoke(self, messages: List[Dict[str, str]], max_output_tokens: int = None) -> str:
         payload = {
             "model": self.model,
             "messages": messages,
             "temperature": self.temperature,
+            "max_tokens": max_output_tokens or self.max_output_tokens,
         }
+        if self.streaming:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
         
-        if self.json_response:
+        if self.response_schema:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": self.response_schema, "strict": True}
+            }
+        elif self.json_response:
             payload["response_format"] = {"type": "json_object"}
         
         try:
-            response_json = self._make_request(self.model_endpoint, self.headers, payload)
+            if self.streaming:
+                content = self._stream_request(self.model_endpoint, self.headers, payload, self._stream_event, messages)
+            else:
+                response_json = self._make_request(self.model_endpoint, self.headers, payload)
+                usage = response_json.get('usage', {})
+                self._record_usage(usage.get('prompt_tokens'), usage.get('completion_tokens'))
+                content = response_json['choices'][0]['message']['content']
 
             if self.json_response:
-                response = json.dumps(json.loads(response_json['choices'][0]['message']['content']))
+                response = self._normalize_json(content)
             else:
-                response = response_json['choices'][0]['message']['content']
+                response = content
 
             return response
         except requests.RequestException as e:
             logger.error(f"Error in invoking OpenAI model: {str(e)}")
             return json.dumps({"error": f"Error in invoking model: {str(e)}"})
-        except json.JSONDecodeError as e:
+        except (ValueError, KeyError) as e:
             logger.error(f"Error processing OpenAI response: {str(e)}")
-            return json.dumps({"error": f"Error processing response: {str(e)}"})
\ No newline at end of file
+            return json.dumps({"error": f"Error processing response: {str(e)}"})
+
+    @staticmethod
+    def _stream_event(event: Dict, usage: Dict) -> str:
+        if 'error' in event:
+            raise ValueError(event['error'].get('message', event['error']))
+        if event.get('usage'):
+            usage['input'] = event['usage'].get('prompt_tokens')
+            usage['output'] = event['usage'].get('completion_tokens')
+        if not event.get('choices'):
+            return ''
+        return event['choices'][0].get('delta', {}).get('content') or ''
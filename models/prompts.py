@@ -28,9 +28,53 @@ Your response should be in JSON format with the following structure:
 Remember, your classification and reasoning must be based SOLELY on the information provided in this prompt. Do not introduce any external information or make assumptions beyond what is given.
 """
 
+CATEGORY_EXTRACTION_PROMPT = """
+You are an AI assistant that reads excerpts of a specification book and lists the classification categories it defines. Use ONLY the information in the excerpts below.
+
+Excerpts:
+
+{context}
+
+List every distinct category an item can be classified into according to these excerpts, with a one-sentence description of what belongs in it.
+
+Your response should be in JSON format with the following structure:
+{{
+    "categories": [
+        {{"name": "The category name as written in the specification book", "description": "What belongs in this category"}}
+    ]
+}}
+"""
+
 GUIDED_JSON = {
-    "primary_classification": "string",
-    "classification": "string",
-    "reasoning": "string",
-    "confidence": "number"
-}
\ No newline at end of file
+    "type": "object",
+    "properties": {
+        "primary_classification": {"type": "string"},
+        "classification": {"type": "string"},
+        "reasoning": {"type": "string"},
+        "confidence": {"type": "number"}
+    },
+    "required": ["primary_classification", "classification", "reasoning", "confidence"],
+    "additionalProperties": False
+}
+
+CATEGORY_JSON = {
+    "type": "object",
+    "properties": {
+        "categories": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"}
+                },
+                "required": ["name", "description"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["categories"],
+    "additionalProperties": False
+}
+
+REASK_INSTRUCTION = "Your previous answer could not be parsed. Respond with only a single JSON object with the keys primary_classification, classification, reasoning and confidence, and no other text."
\ No newline at end of file
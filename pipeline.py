@@ -1,23 +1,63 @@
 import argparse
+import os
+import time
+import random
+import json
+import multiprocessing
+import threading
+import numpy as np
+import yaml
 from utils.config_loader import Config
 from src.document_processor import DocumentProcessor
 from src.embedding_manager import EmbeddingManager
 from src.vector_store import VectorStore
 from src.classification_manager import ClassificationManager
+from src.shard_manager import ShardManager
+from src.stage_pipeline import Stage, StagePipeline
+from src.zero_shot_classifier import ZeroShotClassifier
+from src.collection_registry import CollectionRegistry
+from src.token_budget import BudgetExceeded, TokenEstimator
+from models.prompts import CATEGORY_JSON
+from concurrent.futures import ThreadPoolExecutor
 from utils.file_handler import FileHandler
 from tqdm import tqdm
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+RUN_SPEC_KEYS = ('model_type', 'model_name', 'spec_book_description', 'item_description', 'weighted_spec',
+                 'sheet', 'column', 'headless', 'files')
+
 class Pipeline:
-    def __init__(self):
+    def __init__(self, run_spec=None, headless=None):
         self.config = Config()
+        self.run_spec = run_spec or {}
+        self.headless = self.config.get('headless', False) if headless is None else headless
         self.doc_processor = DocumentProcessor()
         self.embedding_manager = EmbeddingManager()
-        self.vector_store = VectorStore(default_collection_name=self.config.collection_name)
+        self.vector_store = VectorStore(default_collection_name=self.config.collection_name,
+                                        embedding_manager=self.embedding_manager)
+        self.collection_registry = CollectionRegistry(self.vector_store)
         self.file_handler = FileHandler()
+        self.file_handler.interactive = not self.headless
         self.classification_manager = None
+        self.classification_mode = self.config.get('classification_mode', 'llm')
+        self.zero_shot = None
+        # One classifier per collection, each scores against the categories of its own spec book
+        self.zero_shot_classifiers = {}
+        self._zero_shot_lock = threading.Lock()
+        # One bound on concurrent LLM calls, however many collection groups run side by side
+        llm_workers = self.config.get('stage_llm_workers', 8) if self.config.get('pipeline_stages_enabled', True) else 1
+        self._llm_slots = threading.BoundedSemaphore(llm_workers)
+        if self.classification_mode not in ('llm', 'embedding', 'hybrid'):
+            raise ValueError(f"Unsupported classification mode: {self.classification_mode}")
+        if self.classification_mode != 'llm':
+            self.zero_shot = self._zero_shot_for(self.vector_store)
+        self.exact_match_enabled = self.config.get('exact_match_enabled', False) and self.vector_store.lexical_index is not None
+        if self.exact_match_enabled and self.classification_mode != 'llm':
+            # A section heading is not one of the zero-shot categories, so the fast path would mix two label sets
+            logger.info("Exact spec-code matching is skipped in the embedding and hybrid classification modes")
+            self.exact_match_enabled = False
         self.logger = logger
 
     def reset_vector_store(self):
@@ -26,40 +66,96 @@ class Pipeline:
 
     def process_and_store_documents(self):
         try:
-            processed_documents = self.doc_processor.process_documents()
-            self.logger.info(f"Processed {len(processed_documents)} documents")
-
             pipeline_batch_size = self.config.get('pipeline_batch_size', 100)  # Default to 100 if not specified
-            total_batches = (len(processed_documents) + pipeline_batch_size - 1) // pipeline_batch_size
-            
-            for i in tqdm(range(0, len(processed_documents), pipeline_batch_size), total=total_batches, desc="Processing batches"):
-                batch = processed_documents[i:i+pipeline_batch_size]
-                self._process_batch(batch)
+            file_chunks = self.doc_processor.iter_document_files(
+                workers=self.config.get('ingest_parse_workers', 2),
+                queue_size=self.config.get('ingest_queue_size', 4)
+            )
 
+            # Chunks are embedded and stored as soon as a full batch is buffered
+            buffer = []
+            total_chunks = 0
+            stored = self.vector_store.chunk_ids_by_source()
+            for chunks in file_chunks:
+                self._remove_stale_chunks(stored, chunks)
+                buffer.extend(chunks)
+                while len(buffer) >= pipeline_batch_size:
+                    self._process_batch(buffer[:pipeline_batch_size])
+                    total_chunks += pipeline_batch_size
+                    buffer = buffer[pipeline_batch_size:]
+            if buffer:
+                self._process_batch(buffer)
+                total_chunks += len(buffer)
+
+            # Files no longer in the specifications directory take their chunks with them
+            if os.path.exists(self.doc_processor.specifications_dir):
+                present = set(self.doc_processor.list_files())
+                removed = [doc_id for source, ids in stored.items() if source not in present for doc_id in ids]
+                if removed:
+                    self.logger.info(f"Removing {len(removed)} chunks of files that were removed from the specifications directory")
+                    self.vector_store.delete_documents(removed)
+
+            if total_chunks == 0:
+                self.logger.warning("No documents were successfully processed.")
+            self.logger.info(f"Processed and stored {total_chunks} chunks")
             self.logger.info("Document processing and storage completed successfully")
         except Exception as e:
             self.logger.error(f"Error in document processing and storage: {str(e)}", exc_info=True)
             raise
 
+    def _remove_stale_chunks(self, stored, chunks):
+        # Ids are positional, a file that now yields fewer chunks leaves the old tail behind
+        # A file that failed to parse yields nothing and keeps its stored chunks
+        if not chunks:
+            return
+        source = str(chunks[0].metadata.get('chunk_id', '')).rpartition(':')[0]
+        stale = [doc_id for doc_id in stored.pop(source, []) if int(doc_id.rpartition(':')[2]) >= len(chunks)]
+        if stale:
+            self.logger.info(f"Removing {len(stale)} chunks that {source} no longer produces")
+            self.vector_store.delete_documents(stale)
+
     def _process_batch(self, batch):
+        batch = self.vector_store.filter_changed_documents(batch)
+        if not batch:
+            return
         texts = [doc.page_content for doc in batch]
         embeddings = self.embedding_manager.encode(texts, show_progress=False)
         self.vector_store.store_documents(batch, embeddings)
 
     def verify_storage(self):
+        # 'off' skips the check, 'sample' reads the catalog and a few stored records, 'full' also runs a test search
+        mode = self.config.get('verify_storage', 'sample')
+        if mode == 'off':
+            return
         try:
-            total_docs = self.vector_store.get_document_count()
-            self.logger.info(f"Total documents in storage: {total_docs}")
+            stats = self.vector_store.collection_stats()
+            total_docs = stats['chunk_count']
+            self.logger.info(f"Total documents in storage: {total_docs} from {len(stats['sources'])} source files "
+                             f"(model {stats['embedding_model']}, dimension {stats['dimension']})")
 
             if total_docs == 0:
                 self.logger.warning("No documents found in storage")
                 return
 
-            self._sample_documents()
+            if mode == 'full':
+                self._sample_documents()
+            else:
+                self._check_sample_records(stats)
         except Exception as e:
             self.logger.error(f"Error in storage verification: {str(e)}", exc_info=True)
             raise
 
+    def _check_sample_records(self, stats, num_samples=5):
+        sample = self.vector_store.vector_store._collection.peek(num_samples)
+        expected = self.embedding_manager.model.get_sentence_embedding_dimension()
+        for doc_id, embedding in zip(sample['ids'], sample['embeddings']):
+            if len(embedding) != expected:
+                raise RuntimeError(f"Stored vector {doc_id} has dimension {len(embedding)}, the embedding model produces {expected}")
+        if stats['embedding_model'] and stats['embedding_model'] != self.embedding_manager.model_name:
+            self.logger.warning(f"Collection was embedded with {stats['embedding_model']}, "
+                                f"the configured model is {self.embedding_manager.model_name}")
+        self.logger.info(f"Checked {len(sample['ids'])} sample records")
+
     def _sample_documents(self, num_samples=5):
         sample_query = "sample query for verification"
         results = self.vector_store.similarity_search(sample_query, k=num_samples)
@@ -73,23 +169,438 @@ class Pipeline:
 
     def process_and_classify_items(self):
         try:
-            file_path = self.file_handler.get_input_file()
-            items, chosen_column, _ = self.file_handler.read_input_file(file_path)
-            
-            similar_docs = []
-            for item in tqdm(items, desc="Retrieving similar documents"):
-                docs = self.vector_store.similarity_search(item, k=3)
-                similar_docs.append(docs)
-            
-            classified_items = self.classification_manager.process_and_classify_items(items, similar_docs)
-            
-            self.file_handler.write_results(items, classified_items, chosen_column)
+            files = self.file_handler.get_input_files(list(self.run_spec.get('files') or []))
+            classified_items = []
+            # Every file reuses the loaded models, the vector store and its caches
+            for file_path in files:
+                try:
+                    classified_items.extend(self.process_and_classify_file(file_path, self._output_name(file_path, files)))
+                except BudgetExceeded as e:
+                    self.logger.warning(f"{str(e)}. Stopped while classifying {file_path}")
+                    print(f"\n{str(e)}. The results written so far are kept, and answered items are served from the "
+                          f"response checkpoint when the run is repeated.")
+                    break
             return classified_items
         except Exception as e:
             self.logger.error(f"Error in processing and classifying items: {str(e)}", exc_info=True)
             raise
 
-    def run(self, reset=False, model_type=None, model_name=None):
+    def process_and_classify_file(self, file_path, output_name='classification_results'):
+        self.logger.info(f"Classifying items from {file_path}")
+        file_spec = self._file_spec(file_path)
+        self._apply_descriptions(file_spec)
+        read_options = {'sheet': file_spec.get('sheet'), 'column': file_spec.get('column')}
+
+        collection_column = self.config.get('collection_column')
+        if collection_column:
+            items, chosen_column, _, columns = self.file_handler.read_input_file(file_path, extra_columns=[collection_column], **read_options)
+            results = [None] * len(items)
+            try:
+                self.classify_items_by_collection(items, columns[collection_column], results=results)
+            except BudgetExceeded:
+                # The groups run side by side, so the rows classified before the stop are spread over the file
+                done = [index for index, result in enumerate(results) if result is not None]
+                self.file_handler.write_results([items[index] for index in done], [results[index] for index in done],
+                                                chosen_column, self._select_rows(columns, done), output_name)
+                raise
+            self.file_handler.write_results(items, results, chosen_column, columns, output_name)
+            return results
+
+        items, chosen_column, _, columns = self.file_handler.read_input_file(file_path, **read_options)
+
+        classified_items = []
+
+        def collect_results():
+            for item, result in zip(items, self.iter_classify_items(items)):
+                classified_items.append(result)
+                yield item, result
+
+        self.file_handler.write_results_stream(collect_results(), chosen_column, columns, output_name)
+        return classified_items
+
+    @staticmethod
+    def _select_rows(columns, indices):
+        selected = {}
+        for name, column in columns.items():
+            values = column.to_pylist() if hasattr(column, 'to_pylist') else column
+            selected[name] = [values[index] for index in indices]
+        return selected
+
+    def _file_spec(self, file_path):
+        # Entries under 'files' override the run-wide settings for one input file
+        spec = {key: value for key, value in self.run_spec.items() if key != 'files'}
+        spec.update((self.run_spec.get('files') or {}).get(os.path.basename(file_path)) or {})
+        return spec
+
+    def _apply_descriptions(self, spec):
+        if self.classification_manager and spec.get('spec_book_description') is not None:
+            self.classification_manager.set_descriptions(spec['spec_book_description'], spec.get('item_description'),
+                                                         spec.get('weighted_spec'))
+
+    @staticmethod
+    def _output_name(file_path, files):
+        # A single input keeps the historical results file name
+        if len(files) == 1:
+            return 'classification_results'
+        return f"classification_results_{os.path.splitext(os.path.basename(file_path))[0]}"
+
+    def _collection_name(self, name):
+        # Empty cells use the default collection
+        if isinstance(name, str) and name.strip():
+            return name.strip()
+        return self.vector_store.current_collection_name
+
+    @staticmethod
+    def _unknown_collection_result(item, name):
+        return {
+            'item': item,
+            'primary_classification': 'Error',
+            'classification': 'Error',
+            'reasoning': f"Unknown collection '{name}'",
+            'confidence': 0.0
+        }
+
+    def classify_items_by_collection(self, items, collection_names, on_batch=None, results=None):
+        # Results are filled in as they arrive, so a caller passing its own list keeps them when the budget stops the run
+        groups = {}
+        for index, name in enumerate(collection_names):
+            groups.setdefault(self._collection_name(name), []).append(index)
+        self.logger.info(f"Classifying {len(items)} items across {len(groups)} collections")
+
+        results = results if results is not None else [None] * len(items)
+        # Misspelt or invalid names are reported per item instead of creating a collection or failing the file
+        known = self.collection_registry.known_collections()
+        unknown = sorted(name for name in groups if name not in known)
+        if unknown:
+            self.logger.warning(f"{sum(len(groups[name]) for name in unknown)} items name unknown collections: {', '.join(unknown)}")
+            for name in unknown:
+                for index in groups.pop(name):
+                    results[index] = self._unknown_collection_result(items[index], name)
+
+        # Prompts and category loading happen once, before the groups start in parallel
+        if groups and self.classification_manager and self.classification_manager.spec_book_description is None:
+            self.classification_manager.collect_user_input()
+        for name in groups:
+            self._prepare_zero_shot(self.collection_registry.get(name))
+
+        def classify_group(name):
+            store = self.collection_registry.get(name)
+            group_items = [items[index] for index in groups[name]]
+            for index, result in zip(groups[name], self.iter_classify_items(group_items, on_batch, vector_store=store)):
+                results[index] = result
+
+        # Each group runs its own stage pipeline against a warm handle from the registry
+        with ThreadPoolExecutor(max_workers=self.config.get('collection_group_workers', 4)) as executor:
+            list(executor.map(classify_group, list(groups)))
+        return results
+
+    def classify_items(self, items, on_batch=None, vector_store=None):
+        return list(self.iter_classify_items(items, on_batch, vector_store))
+
+    def iter_classify_items(self, items, on_batch=None, vector_store=None):
+        batch_size = self.config.get('pipeline_batch_size', 100)
+        vector_store = vector_store or self.vector_store
+
+        zero_shot = self._prepare_zero_shot(vector_store)
+
+        if self.classification_mode == 'embedding':
+            # Fully offline: every item gets the nearest category, no retrieval or LLM calls
+            with tqdm(total=len(items), desc="Classifying items") as pbar:
+                for i in range(0, len(items), zero_shot.batch_size):
+                    batch = items[i:i+zero_shot.batch_size]
+                    results = self._exact_matches(batch, vector_store)
+                    pending = [index for index, result in enumerate(results) if result is None]
+                    for index, result in zip(pending, zero_shot.classify_texts([batch[index] for index in pending])):
+                        results[index] = result
+                    yield from results
+                    pbar.update(len(batch))
+                    if on_batch:
+                        on_batch()
+            return
+
+        if self.config.get('pipeline_stages_enabled', True):
+            # Ask for the descriptions up front, the LLM stage runs in worker threads
+            if self.classification_manager.spec_book_description is None:
+                self.classification_manager.collect_user_input()
+            with tqdm(total=len(items), desc="Classifying items") as pbar:
+                payloads = ({'item': item} for item in items)
+                for count, result in enumerate(self._build_stage_pipeline(vector_store).run(payloads), 1):
+                    pbar.update(1)
+                    if on_batch and count % batch_size == 0:
+                        on_batch()
+                    yield result
+            return
+
+        total_batches = (len(items) + batch_size - 1) // batch_size
+        for i in tqdm(range(0, len(items), batch_size), total=total_batches, desc="Classifying items"):
+            batch = items[i:i+batch_size]
+            results = self._exact_matches(batch, vector_store)
+            remaining = [index for index, result in enumerate(results) if result is None]
+            zero_shot_results = zero_shot.classify_texts([batch[index] for index in remaining]) if zero_shot else []
+            for index, result in zip(remaining, zero_shot_results):
+                results[index] = result
+            # Exact matches are done, in hybrid mode only the ambiguous items go to the LLM
+            pending = [index for index, result in enumerate(results) if result is None or result.get('ambiguous')]
+            if pending:
+                pending_items = [batch[index] for index in pending]
+                similar_docs = [vector_store.similarity_search(item, k=self.classification_manager.retrieval_k) for item in pending_items]
+                with self._llm_slots:
+                    llm_results = self.classification_manager.process_and_classify_items(pending_items, similar_docs)
+                for index, result in zip(pending, llm_results):
+                    results[index] = result
+            yield from results
+            if on_batch:
+                on_batch()
+
+    def _exact_matches(self, items, vector_store):
+        return [self._exact_match_result(item, vector_store) for item in items]
+
+    def _exact_match_result(self, item, vector_store):
+        # An item naming a spec code that heads exactly one section is classified without retrieval or the LLM
+        match = vector_store.exact_match(item) if self.exact_match_enabled else None
+        if match is None:
+            return None
+        return {
+            'item': item,
+            'primary_classification': match['label'],
+            'classification': match['label'],
+            'reasoning': f"Exact match of spec code '{match['code']}' in the section heading '{match['label']}'",
+            'confidence': self.config.get('exact_match_confidence', 0.9)
+        }
+
+    def _zero_shot_for(self, vector_store):
+        name = vector_store.current_collection_name
+        with self._zero_shot_lock:
+            if name not in self.zero_shot_classifiers:
+                self.zero_shot_classifiers[name] = ZeroShotClassifier(self.embedding_manager, name)
+            return self.zero_shot_classifiers[name]
+
+    def _prepare_zero_shot(self, vector_store=None):
+        if self.zero_shot is None:
+            return None
+        vector_store = vector_store or self.vector_store
+        classifier = self._zero_shot_for(vector_store)
+        with self._zero_shot_lock:
+            if classifier.category_matrix is None:
+                llm = None
+                if self.classification_manager:
+                    # The classification client enforces the four-field answer schema, extraction needs the category list
+                    llm = self.classification_manager.create_llm(CATEGORY_JSON)
+                    llm.usage_callback = self.classification_manager.budget.record
+                classifier.load_categories(vector_store, llm)
+        return classifier
+
+    def _build_stage_pipeline(self, vector_store):
+        retrieval_k = self.classification_manager.retrieval_k
+        zero_shot_classifier = self._prepare_zero_shot(vector_store)
+
+        def exact_match(payload):
+            result = self._exact_match_result(payload['item'], vector_store)
+            if result is not None:
+                payload['result'] = result
+            return payload
+
+        def embed(payloads):
+            # Items with cached retrievals skip both embedding and the vector search
+            uncached = []
+            for payload in payloads:
+                if 'result' in payload:
+                    continue
+                docs = vector_store.get_cached_results(payload['item'], k=retrieval_k)
+                if docs is None:
+                    uncached.append(payload)
+                else:
+                    payload['docs'] = docs
+            if uncached:
+                embeddings = self.embedding_manager.encode([payload['item'] for payload in uncached], show_progress=False)
+                for payload, embedding in zip(uncached, embeddings):
+                    payload['embedding'] = embedding
+            return payloads
+
+        def zero_shot(payloads):
+            pending = [payload for payload in payloads if 'result' not in payload]
+            if not pending:
+                return payloads
+            missing = [payload for payload in pending if 'embedding' not in payload]
+            if missing:
+                embeddings = self.embedding_manager.encode([payload['item'] for payload in missing], show_progress=False)
+                for payload, embedding in zip(missing, embeddings):
+                    payload['embedding'] = embedding
+            results = zero_shot_classifier.classify([payload['item'] for payload in pending],
+                                                    np.stack([payload['embedding'] for payload in pending]))
+            # Confident items are done, ambiguous ones continue to retrieval and the LLM
+            for payload, result in zip(pending, results):
+                if not result['ambiguous']:
+                    payload['result'] = result
+            return payloads
+
+        def retrieve(payload):
+            if 'docs' not in payload and 'result' not in payload:
+                payload['docs'] = vector_store.similarity_search_by_vector(payload.pop('embedding'), k=retrieval_k,
+                                                                        query=payload['item'])
+            return payload
+
+        def rerank(payloads):
+            pending = [payload for payload in payloads if 'result' not in payload]
+            if pending:
+                selected = self.classification_manager.select_documents([payload['item'] for payload in pending],
+                                                                        [payload['docs'] for payload in pending])
+                for payload, docs in zip(pending, selected):
+                    payload['docs'] = docs
+            return payloads
+
+        def build_prompt(payload):
+            if 'result' not in payload:
+                payload['context'] = self.classification_manager.build_context(payload.pop('docs'))
+            return payload
+
+        def classify(payload):
+            if 'result' in payload:
+                return payload['result']
+            with self._llm_slots:
+                return self.classification_manager.classify_item(payload['item'], payload['context'])
+
+        stages = [Stage('exact_match', exact_match, workers=1)] if self.exact_match_enabled else []
+        stages += [
+            Stage('embed', embed, workers=self.config.get('stage_embed_workers', 1),
+                  batch_size=self.config.get('stage_embed_batch_size', 64))
+        ]
+        if zero_shot_classifier is not None:
+            stages.append(Stage('zero_shot', zero_shot, workers=1, batch_size=self.config.get('stage_embed_batch_size', 64)))
+        stages.append(Stage('retrieve', retrieve, workers=self.config.get('stage_retrieve_workers', 4)))
+        if self.classification_manager.reranker is not None:
+            stages.append(Stage('rerank', rerank, workers=self.config.get('stage_rerank_workers', 1),
+                                batch_size=self.config.get('stage_rerank_batch_size', 32)))
+        stages += [
+            Stage('prompt', build_prompt, workers=self.config.get('stage_prompt_workers', 1)),
+            Stage('llm', classify, workers=self.config.get('stage_llm_workers', 8))
+        ]
+        return StagePipeline(stages, queue_size=self.config.get('pipeline_queue_size', 256), stop_on=(BudgetExceeded,))
+
+    def process_and_classify_items_sharded(self, num_shards, num_workers=None, job_dir=None, prepare_only=False):
+        try:
+            files = self.file_handler.get_input_files(list(self.run_spec.get('files') or []))
+            classified_items = []
+            for file_path in files:
+                stem = os.path.splitext(os.path.basename(file_path))[0]
+                if job_dir:
+                    file_job_dir = job_dir if len(files) == 1 else os.path.join(job_dir, stem)
+                else:
+                    file_job_dir = os.path.join(self.config.get('shard_dir', 'data/output/shards'), stem)
+                classified_items.extend(self._process_file_sharded(file_path, num_shards, num_workers, file_job_dir,
+                                                                   prepare_only, self._output_name(file_path, files)))
+            return classified_items
+        except Exception as e:
+            self.logger.error(f"Error in sharded classification: {str(e)}", exc_info=True)
+            raise
+
+    def _process_file_sharded(self, file_path, num_shards, num_workers, job_dir, prepare_only, output_name):
+        shard_manager = ShardManager(job_dir)
+        fingerprint = ShardManager.fingerprint(file_path, num_shards)
+
+        if shard_manager.exists():
+            shard_manager.check_fingerprint(fingerprint)
+            self.logger.info(f"Resuming sharded job in {job_dir}")
+        else:
+            file_spec = self._file_spec(file_path)
+            collection_column = self.config.get('collection_column')
+            items, chosen_column, _, columns = self.file_handler.read_input_file(
+                file_path, extra_columns=[collection_column] if collection_column else None,
+                sheet=file_spec.get('sheet'), column=file_spec.get('column')
+            )
+            collections = [self._collection_name(name) for name in columns[collection_column]] if collection_column else None
+            self._apply_descriptions(file_spec)
+            if self.classification_manager.spec_book_description is None:
+                self.classification_manager.collect_user_input()
+            run_spec = {
+                'input_file': file_path,
+                'chosen_column': chosen_column,
+                'output_name': output_name,
+                'model_type': self.classification_manager.model_type,
+                'model_name': self.classification_manager.model_name,
+                'spec_book_description': self.classification_manager.spec_book_description,
+                'item_description': self.classification_manager.item_description,
+                'weighted_spec': self.classification_manager.weighted_spec,
+                # Caps apply to each worker process
+                'max_tokens': self.classification_manager.budget.max_tokens,
+                'max_cost': self.classification_manager.budget.max_cost
+            }
+            shard_manager.prepare(items, num_shards, run_spec, columns, collections, fingerprint)
+
+        if prepare_only:
+            print(f"\nShards prepared in {job_dir}. Start workers with: python pipeline.py --shard-worker --job-dir {job_dir}")
+            return []
+
+        self.run_local_shard_workers(job_dir, num_workers)
+        return self.merge_shards(job_dir)
+
+    def run_local_shard_workers(self, job_dir, num_workers=None):
+        num_workers = num_workers or self.config.get('shard_workers', 1)
+        self.logger.info(f"Starting {num_workers} local shard workers for {job_dir}")
+        # Spawn so every worker builds its own embedding model, vector store and LLM client
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=_shard_worker_process, args=(job_dir,)) for _ in range(num_workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        failed_workers = [p.pid for p in processes if p.exitcode != 0]
+        if failed_workers:
+            self.logger.warning(f"Shard workers exited with errors: {failed_workers}")
+
+    def run_shard_worker(self, job_dir, worker_id=None):
+        shard_manager = ShardManager(job_dir)
+        run_spec = shard_manager.load_manifest()['run_spec']
+        worker_id = worker_id or ShardManager.default_worker_id()
+        retry_delay = self.config.get('shard_retry_delay', 5)
+
+        self.classification_manager = ClassificationManager(model_type=run_spec['model_type'], model_name=run_spec['model_name'])
+        self.classification_manager.set_descriptions(
+            run_spec['spec_book_description'],
+            run_spec['item_description'],
+            run_spec['weighted_spec']
+        )
+        self._apply_budget(run_spec.get('max_tokens'), run_spec.get('max_cost'))
+
+        completed = 0
+        while True:
+            shard_id = shard_manager.claim_shard(worker_id)
+            if shard_id is None:
+                break
+            try:
+                row_ids, items, collections = shard_manager.read_shard(shard_id)
+                heartbeat = lambda: shard_manager.heartbeat(shard_id)
+                if collections is not None:
+                    results = self.classify_items_by_collection(items, collections, on_batch=heartbeat)
+                else:
+                    results = self.classify_items(items, on_batch=heartbeat)
+                shard_manager.complete_shard(shard_id, row_ids, results)
+                completed += 1
+            except BudgetExceeded as e:
+                # Not a failure of the shard, it is released for a later run without using up an attempt
+                shard_manager.release_lock(shard_id)
+                self.logger.warning(f"{str(e)}. Worker {worker_id} stopped and released shard {shard_id}")
+                break
+            except Exception as e:
+                shard_manager.fail_shard(shard_id, str(e))
+                time.sleep(retry_delay)
+
+        # Worker processes end without running atexit handlers, so buffered cache writes go out here
+        self.vector_store.retrieval_cache.flush()
+        self.logger.info(f"Worker {worker_id} finished after completing {completed} shards")
+        return completed
+
+    def merge_shards(self, job_dir):
+        shard_manager = ShardManager(job_dir)
+        run_spec = shard_manager.load_manifest()['run_spec']
+        items, classified_items = shard_manager.merge()
+        self.file_handler.write_results(items, classified_items, run_spec['chosen_column'], shard_manager.load_columns(),
+                                        run_spec.get('output_name', 'classification_results'))
+        return classified_items
+
+    def run(self, reset=False, model_type=None, model_name=None, shards=None, workers=None, job_dir=None, prepare_only=False,
+            dry_run=False, sample_size=None, max_tokens=None, max_cost=None):
         try:
             self.logger.info("Starting pipeline execution")
             
@@ -99,12 +610,36 @@ class Pipeline:
             self.process_and_store_documents()
             self.verify_storage()
             
-            model_type = model_type or self.prompt_for_model_type()
-            self.classification_manager = ClassificationManager(model_type=model_type, model_name=model_name)
+            # Embedding-only runs need no LLM unless the categories still have to be extracted
+            # With a collection column, other collections may still need their categories extracted
+            if (self.classification_mode != 'embedding' or shards or self.config.get('collection_column')
+                    or not self.zero_shot.has_categories()):
+                model_type = model_type or self.run_spec.get('model_type')
+                if not model_type and self.headless:
+                    # Headless runs fall back to the configured model type instead of asking
+                    model_type = self.config.get('model_type')
+                    if not model_type:
+                        raise ValueError("No model type given for a headless run. Use --model-type, the run spec or model_type in the config.")
+                model_type = model_type or self.prompt_for_model_type()
+                model_name = model_name or self.run_spec.get('model_name')
+                self.classification_manager = ClassificationManager(model_type=model_type, model_name=model_name)
+                self.classification_manager.interactive = not self.headless
+                self._apply_descriptions(self.run_spec)
+                self._apply_budget(max_tokens, max_cost)
+
+            if dry_run:
+                return self.dry_run(sample_size, workers if shards else None)
             
-            classified_items = self.process_and_classify_items()
+            if shards:
+                classified_items = self.process_and_classify_items_sharded(shards, workers, job_dir, prepare_only)
+            else:
+                classified_items = self.process_and_classify_items()
             
-            self._print_summary(classified_items)
+            if classified_items:
+                self._print_summary(classified_items)
+            if self.classification_manager:
+                self.logger.info(f"LLM usage: {self.classification_manager.budget.summary()}")
+                self.logger.info(f"LLM timing: {self.classification_manager.llm.timing_summary()}")
             
             self.logger.info("Pipeline execution completed successfully")
             return classified_items
@@ -112,9 +647,139 @@ class Pipeline:
             self.logger.error(f"Error in pipeline execution: {str(e)}")
             raise
         finally:
+            self.vector_store.retrieval_cache.flush()
             # Clear caches
             self.embedding_manager.clear_cache()
-            self.vector_store.clear_cache()
+            self.collection_registry.clear_cache()
+            if self.classification_manager and self.classification_manager.reranker:
+                self.classification_manager.reranker.clear_cache()
+
+    def _apply_budget(self, max_tokens=None, max_cost=None):
+        self.classification_manager.budget.set_limits(max_tokens, max_cost)
+
+    def dry_run(self, sample_size=None, shard_workers=None):
+        # Renders real prompts for a sample of each input file and projects tokens, cost and wall time without calling the LLM
+        sample_size = sample_size or self.config.get('dry_run_sample_size', 50)
+        manager = self.classification_manager
+        estimator = TokenEstimator(manager.model_type, manager.model_name) if manager else None
+        collection_column = self.config.get('collection_column')
+        files = self.file_handler.get_input_files(list(self.run_spec.get('files') or []))
+        prompts_path = os.path.join(self.file_handler.output_path, 'dry_run_prompts.jsonl')
+        totals = {'items': 0, 'calls': 0.0, 'input_tokens': 0.0, 'output_tokens': 0.0}
+
+        known = self.collection_registry.known_collections() if collection_column else None
+        with open(prompts_path, 'w', encoding='utf-8') as prompts_file:
+            for file_path in files:
+                file_spec = self._file_spec(file_path)
+                self._apply_descriptions(file_spec)
+                read_options = {'sheet': file_spec.get('sheet'), 'column': file_spec.get('column')}
+                if collection_column:
+                    items, _, _, columns = self.file_handler.read_input_file(file_path, extra_columns=[collection_column], **read_options)
+                    collections = columns[collection_column]
+                else:
+                    items, _, _, _ = self.file_handler.read_input_file(file_path, **read_options)
+                    collections = [None] * len(items)
+
+                rows = random.Random(0).sample(range(len(items)), min(sample_size, len(items)))
+                sampled = [(items[row], self._collection_store(collections[row], known)) for row in rows]
+                unknown = sum(1 for _, store in sampled if store is None)
+                if unknown:
+                    print(f"  {unknown} sampled items name unknown collections and are left unclassified")
+                llm_items = self._items_needing_llm([(item, store) for item, store in sampled if store is not None])
+
+                input_tokens = []
+                if manager and manager.spec_book_description is None:
+                    manager.collect_user_input()
+                for item, store in llm_items:
+                    docs = store.similarity_search(item, k=manager.retrieval_k)
+                    context = manager.build_context(manager.select_documents([item], [docs])[0])
+                    messages = manager.build_messages(context, item)
+                    input_tokens.append(estimator.count_messages(messages))
+                    prompts_file.write(json.dumps({'file': os.path.basename(file_path), 'item': item, 'messages': messages},
+                                                  ensure_ascii=False) + "\n")
+
+                llm_share = len(llm_items) / len(sampled) if sampled else 0.0
+                calls = llm_share * len(items)
+                mean_input = sum(input_tokens) / len(input_tokens) if input_tokens else 0
+                mean_output = self.config.get('dry_run_output_tokens', 150) if input_tokens else 0
+                totals['items'] += len(items)
+                totals['calls'] += calls
+                totals['input_tokens'] += mean_input * calls
+                totals['output_tokens'] += mean_output * calls
+                print(f"\n{os.path.basename(file_path)}: {len(items)} items, {len(sampled)} sampled")
+                print(f"  Items sent to the LLM: {llm_share:.0%} (~{calls:.0f} calls)")
+                print(f"  Tokens per call: ~{mean_input:.0f} input, ~{mean_output} output")
+
+        return self._print_projection(totals, prompts_path, shard_workers)
+
+    def _collection_store(self, name, known=None):
+        name = self._collection_name(name)
+        if name == self.vector_store.current_collection_name:
+            return self.vector_store
+        return self.collection_registry.get(name) if known is None or name in known else None
+
+    def _items_needing_llm(self, sampled):
+        pending = [(item, store) for item, store in sampled if self._exact_match_result(item, store) is None]
+        if self.classification_mode == 'embedding':
+            return []
+        if self.classification_mode == 'hybrid' and pending:
+            ambiguous = []
+            for store in {id(store): store for _, store in pending}.values():
+                entries = [entry for entry in pending if entry[1] is store]
+                if not self._zero_shot_for(store).has_categories():
+                    # Extracting the categories would call the LLM, so every item counts as ambiguous
+                    self.logger.warning(f"No category list yet for collection '{store.current_collection_name}', "
+                                        f"the projection assumes its items go to the LLM")
+                    ambiguous.extend(entries)
+                    continue
+                results = self._prepare_zero_shot(store).classify_texts([item for item, _ in entries])
+                ambiguous.extend(entry for entry, result in zip(entries, results) if result['ambiguous'])
+            pending = ambiguous
+        return pending
+
+    def _print_projection(self, totals, prompts_path, shard_workers=None):
+        manager = self.classification_manager
+        model_type = manager.model_type if manager else None
+        workers = self.config.get('stage_llm_workers', 8) if self.config.get('pipeline_stages_enabled', True) else 1
+        workers *= shard_workers or 1
+        latency = self.config.get(f'{model_type}_call_latency', self.config.get('dry_run_call_latency', 2.0))
+        seconds = totals['calls'] * latency / workers
+        # Provider rate limits cap the throughput no matter how many calls run concurrently
+        requests_per_minute = self.config.get(f'{model_type}_requests_per_minute')
+        tokens_per_minute = self.config.get(f'{model_type}_tokens_per_minute')
+        if requests_per_minute:
+            seconds = max(seconds, totals['calls'] / requests_per_minute * 60)
+        if tokens_per_minute:
+            seconds = max(seconds, (totals['input_tokens'] + totals['output_tokens']) / tokens_per_minute * 60)
+        cost = manager.budget.cost(totals['input_tokens'], totals['output_tokens']) if manager else 0.0
+        if manager and not manager.budget.prices:
+            print(f"\nNo price for '{manager.model_name}' in llm_prices, the projected cost is $0")
+
+        projection = {
+            'items': totals['items'],
+            'llm_calls': round(totals['calls']),
+            'input_tokens': round(totals['input_tokens']),
+            'output_tokens': round(totals['output_tokens']),
+            'cost': round(cost, 4),
+            'wall_time_seconds': round(seconds)
+        }
+        print(f"\nProjected for {projection['items']} items: {projection['llm_calls']} LLM calls, "
+              f"{projection['input_tokens']} input and {projection['output_tokens']} output tokens, "
+              f"${projection['cost']:.2f}, about {self._format_duration(seconds)} with {workers} concurrent calls")
+        print(f"Rendered prompts written to {prompts_path}")
+        if manager and manager.budget.max_tokens is not None and projection['input_tokens'] + projection['output_tokens'] > manager.budget.max_tokens:
+            print(f"The projected tokens exceed the token cap of {manager.budget.max_tokens}, the run would stop early.")
+        if manager and manager.budget.max_cost is not None and cost > manager.budget.max_cost:
+            print(f"The projected cost exceeds the cost cap of ${manager.budget.max_cost:.2f}, the run would stop early.")
+        self.logger.info(f"Dry run projection: {projection}")
+        return projection
+
+    @staticmethod
+    def _format_duration(seconds):
+        if seconds >= 3600:
+            return f"{seconds / 3600:.1f} hours"
+        minutes = max(1, round(seconds / 60))
+        return f"{minutes} minute{'s' if minutes != 1 else ''}"
 
     def _print_summary(self, classified_items):
         print(f"\nClassified {len(classified_items)} items.")
@@ -126,6 +791,23 @@ class Pipeline:
             print(f"Confidence: {item['confidence']}")
         print("\nClassification process completed. Results have been written to CSV.")
 
+    @staticmethod
+    def load_run_spec(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            run_spec = yaml.safe_load(f) or {}
+        if not isinstance(run_spec, dict):
+            raise ValueError(f"The run spec in {path} must be a mapping of settings.")
+        unknown = [key for key in run_spec if key not in RUN_SPEC_KEYS]
+        if unknown:
+            raise ValueError(f"Unknown run spec keys in {path}: {', '.join(unknown)}")
+        files = run_spec.get('files')
+        # A plain list names the files to run with the run-wide settings
+        if isinstance(files, list):
+            files = run_spec['files'] = {str(name): {} for name in files}
+        if files is not None and not (isinstance(files, dict) and all(isinstance(spec, dict) or spec is None for spec in files.values())):
+            raise ValueError(f"'files' in {path} must be a list of file names or a mapping of file names to settings.")
+        return run_spec
+
     @staticmethod
     def prompt_for_model_type():
         valid_types = ["ollama", "openai", "claude"]
@@ -142,10 +824,56 @@ class Pipeline:
         parser.add_argument("--reset", action="store_true", help="Reset the vector store before processing")
         parser.add_argument("--model-type", choices=["ollama", "openai", "claude"], help="Specify the model type to use")
         parser.add_argument("--model-name", help="Specify the model name to use")
+        parser.add_argument("--shards", type=int, help="Split the input file into this many shards and classify them in worker processes")
+        parser.add_argument("--workers", type=int, help="Number of local worker processes for a sharded run")
+        parser.add_argument("--job-dir", help="Shared directory holding the shards of a sharded run")
+        parser.add_argument("--prepare-only", action="store_true", help="Only prepare the shards, workers are started separately")
+        parser.add_argument("--shard-worker", action="store_true", help="Run a worker against the shards in --job-dir")
+        parser.add_argument("--merge-shards", action="store_true", help="Merge the completed shards in --job-dir into the results file")
+        parser.add_argument("--retry-failed", action="store_true", help="Allow shards that exhausted their attempts to be retried")
+        parser.add_argument("--run-spec", help="YAML file with the model, descriptions, sheet and column of a run")
+        parser.add_argument("--headless", action="store_true", help="Never prompt, fail when a setting is missing instead")
+        parser.add_argument("--sheet", help="Excel sheet to read, by name")
+        parser.add_argument("--column", help="Input column holding the items, by name")
+        parser.add_argument("--spec-description", help="Description of the specification book")
+        parser.add_argument("--item-description", help="Description of the items to be classified")
+        parser.add_argument("--weighted-spec", help="Specification that should carry more weight")
+        parser.add_argument("--dry-run", action="store_true", help="Render prompts for a sample and project tokens, cost and time without calling the LLM")
+        parser.add_argument("--sample-size", type=int, help="Items sampled per input file in a dry run")
+        parser.add_argument("--max-tokens", type=int, help="Stop the run once the LLM has used this many tokens")
+        parser.add_argument("--max-cost", type=float, help="Stop the run once the estimated LLM cost reaches this amount")
         args = parser.parse_args()
 
-        pipeline = Pipeline()
-        pipeline.run(reset=args.reset, model_type=args.model_type, model_name=args.model_name)
+        if (args.shard_worker or args.merge_shards or args.retry_failed) and not args.job_dir:
+            parser.error("--shard-worker, --merge-shards and --retry-failed require --job-dir")
+
+        if args.retry_failed:
+            ShardManager(args.job_dir).reset_failed()
+
+        run_spec = Pipeline.load_run_spec(args.run_spec) if args.run_spec else {}
+        # Flags take precedence over the run spec
+        overrides = {
+            'sheet': args.sheet,
+            'column': args.column,
+            'spec_book_description': args.spec_description,
+            'item_description': args.item_description,
+            'weighted_spec': args.weighted_spec
+        }
+        run_spec.update({key: value for key, value in overrides.items() if value is not None})
+
+        pipeline = Pipeline(run_spec=run_spec, headless=True if args.headless else run_spec.get('headless'))
+        if args.shard_worker:
+            pipeline.run_shard_worker(args.job_dir)
+        if args.merge_shards:
+            classified_items = pipeline.merge_shards(args.job_dir)
+            pipeline._print_summary(classified_items)
+        if not (args.shard_worker or args.merge_shards):
+            pipeline.run(reset=args.reset, model_type=args.model_type, model_name=args.model_name,
+                         shards=args.shards, workers=args.workers, job_dir=args.job_dir, prepare_only=args.prepare_only,
+                         dry_run=args.dry_run, sample_size=args.sample_size, max_tokens=args.max_tokens, max_cost=args.max_cost)
+
+def _shard_worker_process(job_dir):
+    Pipeline().run_shard_worker(job_dir)
 
 if __name__ == "__main__":
     Pipeline.main()
\ No newline at end of file
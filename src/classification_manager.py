@@ -1,12 +1,15 @@
 from models.base_agent import BaseAgent
-from models.prompts import CLASSIFICATION_PROMPT, GUIDED_JSON
+from models.prompts import CLASSIFICATION_PROMPT, GUIDED_JSON, REASK_INSTRUCTION
+from src.token_budget import TokenBudget, ResponseCheckpoint
 from utils.config_loader import Config
-import json
+from utils.json_parser import extract_json_object
 from functools import lru_cache
 from utils.logger import get_logger
 logger = get_logger(__name__)
 
 class ClassificationManager(BaseAgent):
+    response_schema = GUIDED_JSON
+
     def __init__(self, model_type=None, model_name=None):
         self.config = Config()
         model_type = model_type or self.config.model_type
@@ -15,12 +18,36 @@ class ClassificationManager(BaseAgent):
         self.spec_book_description = None
         self.item_description = None
         self.weighted_spec = None
+        self.interactive = not self.config.get('headless', False)
+        self.max_reasks = self.config.get('classification_max_reasks', 1)
+        self.budget = TokenBudget(self.model_name, model_type=self.model_type)
+        self.llm.usage_callback = self.budget.record
+        # Answered prompts survive a stopped run, re-running serves them without another model call
+        self.checkpoint = ResponseCheckpoint() if self.config.get('response_checkpoint_enabled', True) else None
+        self.reranker = None
+        self.retrieval_k = self.config.get('classification_context_k', 3)
+        if self.config.get('reranker_enabled', False):
+            from src.reranker import Reranker
+            self.reranker = Reranker()
+            # Retrieve a wider candidate set, the re-ranker keeps only the best few for the prompt
+            self.retrieval_k = self.config.get('reranker_candidates_k', 20)
 
     def collect_user_input(self):
+        if not self.interactive:
+            raise ValueError("No spec book and item descriptions given for a headless run. Set them in the run spec or with "
+                             "--spec-description and --item-description.")
         self.spec_book_description = input("Please enter a description for the specification book: ")
         self.item_description = input("Please enter a description for the items to be classified: ")
         self.weighted_spec = input("Enter any weighted specification (or press Enter if none): ")
 
+    def set_descriptions(self, spec_book_description, item_description, weighted_spec=None):
+        # Cached answers were produced with the previous prompt
+        if (spec_book_description, item_description, weighted_spec) != (self.spec_book_description, self.item_description, self.weighted_spec):
+            self.cached_invoke.cache_clear()
+        self.spec_book_description = spec_book_description
+        self.item_description = item_description
+        self.weighted_spec = weighted_spec
+
     def get_prompt(self, context: str, query: str) -> str:
         if self.spec_book_description is None:
             self.collect_user_input()
@@ -35,48 +62,93 @@ class ClassificationManager(BaseAgent):
 
     def process_response(self, response: str) -> dict:
         try:
-            result = json.loads(response)
+            result = extract_json_object(response)
+            if 'error' in result and 'classification' not in result:
+                logger.error(f"Model call failed: {result['error']}")
+                return {
+                    'primary_classification': 'Error',
+                    'classification': 'Error',
+                    'reasoning': f"Error in classification: {result['error']}",
+                    'confidence': 0.0
+                }
             return {
                 'primary_classification': result.get('primary_classification', 'Unknown'),
                 'classification': result.get('classification', 'Unknown'),
                 'reasoning': result.get('reasoning', 'No reasoning provided'),
                 'confidence': float(result.get('confidence', 0.0))
             }
-        except json.JSONDecodeError:
-            logger.error(f"Error decoding JSON response: {response}")
+        except (ValueError, TypeError) as e:
+            logger.error(f"Error processing model response: {str(e)}")
+            logger.debug("Unparseable model response: %s", response)
             return {
                 'primary_classification': 'Error',
                 'classification': 'Error',
                 'reasoning': 'Failed to process the model response',
-                'confidence': 0.0
+                'confidence': 0.0,
+                'parse_failed': True
             }
 
     @lru_cache(maxsize=1000)
     def cached_invoke(self, context: str, query: str) -> dict:
         return super().invoke(context, query)
 
+    def select_documents(self, items, similar_docs):
+        if self.reranker is None:
+            return similar_docs
+        return self.reranker.rerank(items, similar_docs)
+
+    def build_context(self, docs) -> str:
+        return "\n".join([doc[0].page_content if isinstance(doc, tuple) else doc.page_content for doc in docs])
+
+    def reask(self, context: str, query: str) -> dict:
+        # Only rows whose answer could not be parsed are asked again, bypassing the cache
+        messages = self.build_messages(context, query)
+        messages[1]["content"] = f"{query}\n\n{REASK_INSTRUCTION}"
+        result = {}
+        for attempt in range(1, self.max_reasks + 1):
+            logger.debug("Re-asking for unparseable response (attempt %d/%d)", attempt, self.max_reasks)
+            result = self.invoke_messages(messages)
+            if not result.get('parse_failed'):
+                break
+        return result
+
+    def classify_item(self, item: str, context: str) -> dict:
+        key = None
+        if self.checkpoint:
+            key = ResponseCheckpoint.key(self.model_type, self.model_name, self.build_messages(context, item))
+            stored = self.checkpoint.get(key)
+            if stored is not None:
+                return {'item': item, **stored}
+        # Raised outside the try below, a spent budget stops the run instead of producing error rows
+        self.budget.check()
+        try:
+            classification_result = self.cached_invoke(context, item)
+            if classification_result.get('parse_failed') and self.max_reasks > 0:
+                classification_result = self.reask(context, item)
+            result = {
+                'primary_classification': classification_result['primary_classification'],
+                'classification': classification_result['classification'],
+                'reasoning': classification_result['reasoning'],
+                'confidence': classification_result['confidence']
+            }
+            if self.checkpoint and result['classification'] != 'Error':
+                self.checkpoint.put(key, result)
+            return {'item': item, **result}
+        except Exception as e:
+            logger.error(f"Error classifying item: {str(e)}")
+            return {
+                'item': item,
+                'primary_classification': 'Error',
+                'classification': 'Error',
+                'reasoning': f"Error in classification: {str(e)}",
+                'confidence': 0.0
+            }
+
     def process_and_classify_items(self, items, similar_docs):
         classified_items = []
+        similar_docs = self.select_documents(items, similar_docs)
         for item, docs in zip(items, similar_docs):
-            context = "\n".join([doc[0].page_content if isinstance(doc, tuple) else doc.page_content for doc in docs])
-            try:
-                classification_result = self.cached_invoke(context, item)
-                classified_items.append({
-                    'item': item,
-                    'primary_classification': classification_result['primary_classification'],
-                    'classification': classification_result['classification'],
-                    'reasoning': classification_result['reasoning'],
-                    'confidence': classification_result['confidence']
-                })
-            except Exception as e:
-                logger.error(f"Error classifying item: {str(e)}")
-                classified_items.append({
-                    'item': item,
-                    'primary_classification': 'Error',
-                    'classification': 'Error',
-                    'reasoning': f"Error in classification: {str(e)}",
-                    'confidence': 0.0
-                })
+            classified_items.append(self.classify_item(item, self.build_context(docs)))
 
         logger.info(f"Successfully classified {len(classified_items)} items")
-        return classified_items
\ No newline at end of file
+        return classified_items
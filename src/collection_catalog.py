@@ -0,0 +1,104 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Optional
+from utils.config_loader import Config
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+class CollectionCatalog:
+    def __init__(self, db_path: str = None):
+        self.config = Config()
+        self.db_path = db_path or os.path.join(self.config.chroma_db_dir, 'catalog.sqlite')
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS collections (collection TEXT PRIMARY KEY, chunk_count INTEGER NOT NULL, "
+            "embedding_model TEXT, dimension INTEGER, last_ingest REAL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sources (collection TEXT, source TEXT, chunk_count INTEGER NOT NULL, "
+            "PRIMARY KEY (collection, source))"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def source_of(metadata: Optional[Dict]) -> str:
+        metadata = metadata or {}
+        if metadata.get('source'):
+            return os.path.basename(str(metadata['source']))
+        if metadata.get('chunk_id'):
+            return str(metadata['chunk_id']).rsplit(':', 1)[0]
+        return 'unknown'
+
+    def record_added(self, collection: str, source_counts: Dict[str, int], embedding_model: str = None, dimension: int = None):
+        added = sum(source_counts.values())
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO collections (collection, chunk_count, embedding_model, dimension, last_ingest) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(collection) DO UPDATE SET chunk_count = chunk_count + excluded.chunk_count, "
+                "embedding_model = COALESCE(excluded.embedding_model, embedding_model), "
+                "dimension = COALESCE(excluded.dimension, dimension), last_ingest = excluded.last_ingest",
+                (collection, added, embedding_model, dimension, time.time())
+            )
+            self._update_sources(collection, source_counts, 1)
+            self._connection.commit()
+
+    def record_removed(self, collection: str, source_counts: Dict[str, int]):
+        removed = sum(source_counts.values())
+        with self._lock:
+            self._connection.execute(
+                "UPDATE collections SET chunk_count = MAX(chunk_count - ?, 0) WHERE collection = ?", (removed, collection)
+            )
+            self._update_sources(collection, source_counts, -1)
+            self._connection.execute("DELETE FROM sources WHERE collection = ? AND chunk_count <= 0", (collection,))
+            self._connection.commit()
+
+    def _update_sources(self, collection: str, source_counts: Dict[str, int], sign: int):
+        for source, count in source_counts.items():
+            self._connection.execute(
+                "INSERT INTO sources (collection, source, chunk_count) VALUES (?, ?, ?) "
+                "ON CONFLICT(collection, source) DO UPDATE SET chunk_count = chunk_count + excluded.chunk_count",
+                (collection, source, sign * count)
+            )
+
+    def rebuild(self, collection: str, source_counts: Dict[str, int], embedding_model: str = None, dimension: int = None):
+        # Backfills collections written before the catalog existed
+        with self._lock:
+            self._connection.execute("DELETE FROM sources WHERE collection = ?", (collection,))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO collections (collection, chunk_count, embedding_model, dimension, last_ingest) VALUES (?, ?, ?, ?, NULL)",
+                (collection, sum(source_counts.values()), embedding_model, dimension)
+            )
+            self._update_sources(collection, source_counts, 1)
+            self._connection.commit()
+        logger.info(f"Rebuilt catalog entry for collection '{collection}' ({sum(source_counts.values())} chunks)")
+
+    def stats(self, collection: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT chunk_count, embedding_model, dimension, last_ingest FROM collections WHERE collection = ?", (collection,)
+            ).fetchone()
+            if row is None:
+                return None
+            sources = self._connection.execute(
+                "SELECT source, chunk_count FROM sources WHERE collection = ? ORDER BY source", (collection,)
+            ).fetchall()
+        return {
+            'collection': collection,
+            'chunk_count': row[0],
+            'embedding_model': row[1],
+            'dimension': row[2],
+            'last_ingest': row[3],
+            'sources': dict(sources)
+        }
+
+    def remove_collection(self, collection: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM collections WHERE collection = ?", (collection,))
+            self._connection.execute("DELETE FROM sources WHERE collection = ?", (collection,))
+            self._connection.commit()
+        logger.info(f"Removed collection '{collection}' from the catalog")
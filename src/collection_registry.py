@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+from typing import List, Set
+from utils.config_loader import Config
+from src.vector_store import VectorStore
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+class CollectionRegistry:
+    def __init__(self, base_store: VectorStore, max_open: int = None):
+        self.config = Config()
+        self.base_store = base_store
+        self.max_open = max_open or self.config.get('collection_registry_size', 8)
+        self._stores = OrderedDict()
+        self._lock = threading.Lock()
+        self._stores[base_store.current_collection_name] = base_store
+
+    def get(self, collection_name: str) -> VectorStore:
+        with self._lock:
+            if collection_name in self._stores:
+                self._stores.move_to_end(collection_name)
+                return self._stores[collection_name]
+            # Opening through langchain would create and persist an empty collection for a misspelt name
+            if collection_name not in self.known_collections():
+                raise ValueError(f"Collection '{collection_name}' does not exist. Ingest its spec book first.")
+
+            # Every handle shares the client, embedding model and indexes, the retrieval cache keeps a warm tier per collection
+            store = VectorStore(
+                collection_name,
+                embedding_manager=self.base_store.embedding_manager,
+                client=self.base_store.client,
+                catalog=self.base_store.catalog,
+                lexical_index=self.base_store.lexical_index,
+                retrieval_cache=self.base_store.retrieval_cache
+            )
+            self._stores[collection_name] = store
+            self._evict()
+            logger.info(f"Opened collection '{collection_name}' ({len(self._stores)}/{self.max_open} open)")
+            return store
+
+    def _evict(self):
+        while len(self._stores) > self.max_open:
+            for name in self._stores:
+                # The base store is owned by the pipeline and stays open
+                if self._stores[name] is not self.base_store:
+                    evicted = self._stores.pop(name)
+                    evicted.clear_cache()
+                    logger.info(f"Evicted collection '{name}' from the registry")
+                    break
+            else:
+                return
+
+    def known_collections(self) -> Set[str]:
+        return {collection.name for collection in self.base_store.client.list_collections()}
+
+    def open_collections(self) -> List[str]:
+        with self._lock:
+            return list(self._stores.keys())
+
+    def clear_cache(self):
+        with self._lock:
+            for store in self._stores.values():
+                store.clear_cache()
@@ -1,6 +1,7 @@
 from langchain_community.document_loaders.llmsherpa import LLMSherpaFileLoader
-from typing import List
+from typing import List, Iterator
 from utils.config_loader import Config
+from src.stage_pipeline import Stage, StagePipeline
 import os
 from tqdm import tqdm
 from utils.logger import get_logger
@@ -15,30 +16,46 @@ class DocumentProcessor:
         self.supported_extensions = ('.pdf', '.docx', '.pptx', '.html', '.txt', '.xml')
 
     def process_documents(self) -> List[dict]:
-        all_documents = []
-        
+        all_documents = list(self.iter_documents())
+        self._log_processing_results(all_documents)
+        return all_documents
+
+    def iter_documents(self) -> Iterator[dict]:
+        for chunks in self.iter_document_files():
+            yield from chunks
+
+    def iter_document_files(self, workers: int = 1, queue_size: int = 4) -> Iterator[List[dict]]:
         if not self._check_specifications_dir():
-            return all_documents
+            return
 
         files = self._get_supported_files()
         if not files:
-            return all_documents
+            return
 
-        total_files = len(files)
-        with tqdm(total=total_files, desc="Processing documents") as pbar:
-            for filename in files:
-                file_path = os.path.join(self.specifications_dir, filename)
-                logger.info(f"Processing file: {filename}")
-                try:
-                    chunks = self._process_file(file_path)
-                    all_documents.extend(chunks)
-                    logger.info(f"Successfully processed {filename}, extracted {len(chunks)} chunks")
-                except Exception as e:
-                    logger.error(f"Error processing file {filename}: {str(e)}", exc_info=True)
+        # Files are parsed in worker threads, at most queue_size parsed files wait for the consumer
+        parser = StagePipeline([Stage('parse', self._process_named_file, workers=workers)], queue_size=queue_size)
+        with tqdm(total=len(files), desc="Processing documents") as pbar:
+            for chunks in parser.run(files):
                 pbar.update(1)
-        
-        self._log_processing_results(all_documents)
-        return all_documents
+                yield chunks
+
+    def _process_named_file(self, filename: str) -> List[dict]:
+        file_path = os.path.join(self.specifications_dir, filename)
+        logger.info(f"Processing file: {filename}")
+        try:
+            chunks = self._process_file(file_path)
+            for index, chunk in enumerate(chunks):
+                chunk.metadata['chunk_id'] = f"{filename}:{index}"
+            logger.info(f"Successfully processed {filename}, extracted {len(chunks)} chunks")
+            return chunks
+        except Exception as e:
+            logger.error(f"Error processing file {filename}: {str(e)}", exc_info=True)
+            return []
+
+    def list_files(self) -> List[str]:
+        if not os.path.exists(self.specifications_dir):
+            return []
+        return self._get_supported_files()
 
     def _check_specifications_dir(self) -> bool:
         if not os.path.exists(self.specifications_dir):
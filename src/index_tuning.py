@@ -0,0 +1,115 @@
+import argparse
+import time
+import shutil
+import tempfile
+from typing import List, Dict
+import numpy as np
+import chromadb
+from chromadb.config import Settings
+from utils.config_loader import Config
+from src.vector_store import VectorStore
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+class HnswSweep:
+    def __init__(self, vector_store: VectorStore):
+        self.config = Config()
+        self.vector_store = vector_store
+        # The stored settings of the collection, the config may have changed since it was built
+        self.collection_metadata = {key: value for key, value in (self.vector_store.vector_store._collection.metadata or {}).items()
+                                    if key.startswith('hnsw:')}
+        self.space = self.collection_metadata.get('hnsw:space', 'l2')
+
+    def load_collection(self):
+        collection = self.vector_store.vector_store._collection
+        batch_size = self.vector_store.max_batch_size()
+        ids, texts, metadatas, embeddings = [], [], [], []
+        for offset in range(0, collection.count(), batch_size):
+            batch = collection.get(include=['documents', 'metadatas', 'embeddings'], limit=batch_size, offset=offset)
+            ids.extend(batch['ids'])
+            texts.extend(batch['documents'])
+            metadatas.extend(batch['metadatas'])
+            embeddings.extend(batch['embeddings'])
+        return ids, texts, metadatas, np.asarray(embeddings, dtype=np.float32)
+
+    def exact_neighbours(self, embeddings: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+        if self.space == 'l2':
+            scores = -(np.sum(queries ** 2, axis=1)[:, None] - 2 * queries @ embeddings.T + np.sum(embeddings ** 2, axis=1)[None, :])
+        elif self.space == 'cosine':
+            normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+            scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normalized.T
+        else:
+            scores = queries @ embeddings.T
+        return np.argsort(-scores, axis=1)[:, :k]
+
+    def run(self, queries: List[str], search_efs: List[int], k: int) -> List[Dict]:
+        ids, texts, metadatas, embeddings = self.load_collection()
+        if len(ids) == 0:
+            raise ValueError("The collection is empty, ingest documents before tuning the index.")
+        k = min(k, len(ids))
+
+        query_embeddings = self.vector_store.embedding_manager.encode(queries, show_progress=False)
+        exact = self.exact_neighbours(embeddings, query_embeddings, k)
+        truth = [set(ids[i] for i in row) for row in exact]
+
+        # A throwaway on-disk client avoids clashing with the settings of any in-process client
+        sweep_dir = tempfile.mkdtemp(prefix='hnsw_sweep_')
+        client = chromadb.PersistentClient(path=sweep_dir, settings=Settings(anonymized_telemetry=False))
+        results = []
+        for search_ef in search_efs:
+            collection = client.create_collection(
+                name=f"hnsw_sweep_{search_ef}",
+                metadata=self.vector_store.hnsw_metadata(**{**self.collection_metadata, 'hnsw:search_ef': search_ef})
+            )
+            build_start = time.perf_counter()
+            self.vector_store.bulk_load(ids, texts, metadatas, embeddings, collection=collection)
+            build_time = time.perf_counter() - build_start
+
+            latencies, hits = [], 0
+            for query_embedding, expected in zip(query_embeddings, truth):
+                query_start = time.perf_counter()
+                found = collection.query(query_embeddings=[query_embedding.tolist()], n_results=k, include=[])
+                latencies.append(time.perf_counter() - query_start)
+                hits += len(expected.intersection(found['ids'][0]))
+
+            results.append({
+                'search_ef': search_ef,
+                'recall': hits / (k * len(queries)),
+                'mean_latency_ms': 1000 * float(np.mean(latencies)),
+                'p95_latency_ms': 1000 * float(np.percentile(latencies, 95)),
+                'build_time_s': build_time
+            })
+            logger.info(f"search_ef={search_ef}: {results[-1]}")
+            client.delete_collection(collection.name)
+        shutil.rmtree(sweep_dir, ignore_errors=True)
+        return results
+
+def _load_queries(path: str, vector_store: VectorStore, sample_size: int) -> List[str]:
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    # Without a query file, sample stored chunks as queries
+    documents = vector_store.vector_store._collection.get(include=['documents'], limit=sample_size)['documents']
+    return [document[:500] for document in documents]
+
+# Example usage
+if __name__ == "__main__":
+    config = Config()
+    parser = argparse.ArgumentParser(description="Measure HNSW recall and latency for different search_ef values.")
+    parser.add_argument("--collection", default=config.collection_name, help="Collection to tune")
+    parser.add_argument("--queries", help="Text file with one query per line, defaults to sampled chunks")
+    parser.add_argument("--sample-size", type=int, default=200, help="Number of chunks to sample as queries")
+    parser.add_argument("--search-ef", type=int, nargs='+', default=[10, 20, 40, 64, 100, 200], help="search_ef values to try")
+    parser.add_argument("--k", type=int, default=config.get('similarity_search_k', 5), help="Number of neighbours per query")
+    args = parser.parse_args()
+
+    vector_store = VectorStore(args.collection)
+    queries = _load_queries(args.queries, vector_store, args.sample_size)
+    sweep = HnswSweep(vector_store)
+    results = sweep.run(queries, args.search_ef, args.k)
+
+    print(f"\nHNSW sweep over {len(queries)} queries, k={args.k}, space={sweep.space}")
+    print(f"{'search_ef':>10} {'recall':>8} {'mean ms':>9} {'p95 ms':>8} {'build s':>8}")
+    for result in results:
+        print(f"{result['search_ef']:>10} {result['recall']:>8.3f} {result['mean_latency_ms']:>9.2f} "
+              f"{result['p95_latency_ms']:>8.2f} {result['build_time_s']:>8.2f}")
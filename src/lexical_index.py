@@ -0,0 +1,195 @@
+import os
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+from typing import List, Dict, Tuple, Optional
+from utils.config_loader import Config
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+# MasterFormat section numbers and clause numbers with at least three levels, sizes and grades like M12 or DN50 are not codes
+DEFAULT_CODE_PATTERN = r"\b(?:\d{2} \d{2} \d{2}(?:\.\d+)*|\d+(?:\.\d+){2,4})\b"
+
+class LexicalIndex:
+    def __init__(self, db_path: str = None):
+        self.config = Config()
+        self.db_path = db_path or os.path.join(self.config.chroma_db_dir, 'lexical.sqlite')
+        self.k1 = self.config.get('bm25_k1', 1.2)
+        self.b = self.config.get('bm25_b', 0.75)
+        self.max_df_ratio = self.config.get('bm25_max_df_ratio', 0.5)
+        self.max_postings = self.config.get('bm25_max_postings', 2000)
+        self.code_pattern = re.compile(self.config.get('spec_code_pattern') or DEFAULT_CODE_PATTERN)
+        self._collection_stats = {}
+        self._generation = 0
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        # Writes share one connection under the lock, searches read through a connection per thread without it
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS docs (collection TEXT, doc_id TEXT, length INTEGER NOT NULL, PRIMARY KEY (collection, doc_id))"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS terms (collection TEXT, term TEXT, df INTEGER NOT NULL, PRIMARY KEY (collection, term))"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS postings (collection TEXT, term TEXT, doc_id TEXT, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (collection, term, doc_id))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS postings_doc ON postings (collection, doc_id)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS postings_tf ON postings (collection, term, tf DESC)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS codes (collection TEXT, code TEXT, doc_id TEXT, label TEXT NOT NULL, "
+            "PRIMARY KEY (collection, code, doc_id))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS codes_doc ON codes (collection, doc_id)")
+        self._prune_codes()
+        self._connection.commit()
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            self._local.connection = connection
+        return connection
+
+    def _changed(self, collection: str):
+        self._generation += 1
+        self._collection_stats.pop(collection, None)
+
+    def codes(self, text: str) -> List[str]:
+        return list(dict.fromkeys(re.sub(r"\s+", " ", code).upper() for code in self.code_pattern.findall(text)))
+
+    def tokenize(self, text: str) -> List[str]:
+        # Codes are indexed whole as well, so '08 71 00' matches as one term instead of three common numbers
+        return TOKEN_PATTERN.findall(text.lower()) + [f"code:{code}" for code in self.codes(text)]
+
+    @staticmethod
+    def heading(text: str) -> str:
+        return text.strip().split('\n', 1)[0].strip()[:200]
+
+    def heading_code(self, heading: str) -> Optional[str]:
+        # A heading defines a section only when it starts with the code, a code further in is just a reference
+        match = self.code_pattern.match(heading)
+        return re.sub(r"\s+", " ", match.group(0)).upper() if match else None
+
+    def _prune_codes(self):
+        # Codes indexed under an earlier pattern would keep matching until the spec book is ingested again
+        stale = [(collection, code, doc_id) for collection, code, doc_id, label
+                 in self._connection.execute("SELECT collection, code, doc_id, label FROM codes")
+                 if self.heading_code(label) != code]
+        if stale:
+            self._connection.executemany("DELETE FROM codes WHERE collection = ? AND code = ? AND doc_id = ?", stale)
+            logger.info(f"Removed {len(stale)} spec codes that no longer head their section")
+
+    def add(self, collection: str, ids: List[str], texts: List[str]):
+        with self._lock:
+            self._changed(collection)
+            self._remove(collection, ids)
+            postings, codes, docs, df = [], [], [], Counter()
+            for doc_id, text in zip(ids, texts):
+                counts = Counter(self.tokenize(text))
+                docs.append((collection, doc_id, sum(counts.values())))
+                postings.extend((collection, term, doc_id, tf) for term, tf in counts.items())
+                df.update(counts.keys())
+                # Only codes in a chunk's heading define the section it belongs to
+                heading = self.heading(text)
+                code = self.heading_code(heading)
+                if code:
+                    codes.append((collection, code, doc_id, heading))
+            self._connection.executemany("INSERT INTO docs VALUES (?, ?, ?)", docs)
+            self._connection.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", postings)
+            self._connection.executemany("INSERT OR REPLACE INTO codes VALUES (?, ?, ?, ?)", codes)
+            self._connection.executemany(
+                "INSERT INTO terms VALUES (?, ?, ?) ON CONFLICT(collection, term) DO UPDATE SET df = df + excluded.df",
+                [(collection, term, count) for term, count in df.items()]
+            )
+            self._connection.commit()
+
+    def remove(self, collection: str, ids: List[str]):
+        with self._lock:
+            self._changed(collection)
+            self._remove(collection, ids)
+            self._connection.commit()
+
+    def _remove(self, collection: str, ids: List[str]):
+        for doc_id in ids:
+            terms = self._connection.execute(
+                "SELECT term FROM postings WHERE collection = ? AND doc_id = ?", (collection, doc_id)
+            ).fetchall()
+            if not terms:
+                continue
+            self._connection.executemany(
+                "UPDATE terms SET df = df - 1 WHERE collection = ? AND term = ?", [(collection, term) for term, in terms]
+            )
+            self._connection.execute("DELETE FROM postings WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+            self._connection.execute("DELETE FROM codes WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+            self._connection.execute("DELETE FROM docs WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+        self._connection.execute("DELETE FROM terms WHERE collection = ? AND df <= 0", (collection,))
+
+    def doc_count(self, collection: str) -> int:
+        return self._reader().execute("SELECT COUNT(*) FROM docs WHERE collection = ?", (collection,)).fetchone()[0]
+
+    def _stats(self, connection: sqlite3.Connection, collection: str) -> Tuple[int, float]:
+        stats = self._collection_stats.get(collection)
+        if stats is None:
+            generation = self._generation
+            stats = connection.execute("SELECT COUNT(*), AVG(length) FROM docs WHERE collection = ?", (collection,)).fetchone()
+            # A write during the query would make these stats stale, they are recomputed next time instead
+            if generation == self._generation:
+                self._collection_stats[collection] = stats
+        return stats
+
+    def search(self, collection: str, query: str, k: int) -> List[Tuple[str, float]]:
+        terms = set(self.tokenize(query))
+        if not terms:
+            return []
+        connection = self._reader()
+        total, average = self._stats(connection, collection)
+        if not total:
+            return []
+        scores = Counter()
+        for term in terms:
+            row = connection.execute(
+                "SELECT df FROM terms WHERE collection = ? AND term = ?", (collection, term)
+            ).fetchone()
+            # Terms found in most chunks add little to the ranking and have the longest posting lists
+            if row is None or row[0] > self.max_df_ratio * total:
+                continue
+            idf = math.log(1 + (total - row[0] + 0.5) / (row[0] + 0.5))
+            # Common terms are scored on their densest postings only, SQLite picks them without Python walking the list
+            for doc_id, tf, length in connection.execute(
+                "SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.collection = p.collection AND d.doc_id = p.doc_id "
+                "WHERE p.collection = ? AND p.term = ? ORDER BY p.tf DESC LIMIT ?", (collection, term, self.max_postings)
+            ):
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / average))
+        return scores.most_common(k)
+
+    def exact_match(self, collection: str, text: str) -> Optional[Dict]:
+        codes = self.codes(text)
+        if not codes:
+            return None
+        connection = self._reader()
+        matches = {}
+        for code in codes:
+            for label, doc_id in connection.execute(
+                "SELECT label, doc_id FROM codes WHERE collection = ? AND code = ?", (collection, code)
+            ):
+                matches.setdefault(label, (code, doc_id))
+        # Anything but a single section is left to the regular classification
+        if len(matches) != 1:
+            return None
+        label, (code, doc_id) = next(iter(matches.items()))
+        return {'label': label, 'code': code, 'doc_id': doc_id}
+
+    def remove_collection(self, collection: str):
+        with self._lock:
+            self._changed(collection)
+            for table in ('docs', 'terms', 'postings', 'codes'):
+                self._connection.execute(f"DELETE FROM {table} WHERE collection = ?", (collection,))
+            self._connection.commit()
+        logger.info(f"Removed collection '{collection}' from the lexical index")
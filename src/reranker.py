@@ -0,0 +1,73 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+from sentence_transformers import CrossEncoder
+from langchain_core.documents import Document
+from utils.config_loader import Config
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+class Reranker:
+    def __init__(self):
+        self.config = Config()
+        self.model_name = self.config.get('reranker_model_name', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+        self.batch_size = self.config.get('reranker_batch_size', 64)
+        self.top_n = self.config.get('reranker_top_n', 3)
+        self.cache_size = self.config.get('reranker_cache_size', 50000)
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self.model = None
+        self.load_model()
+
+    def load_model(self):
+        logger.info(f"Loading re-ranking model: {self.model_name}")
+        try:
+            self.model = CrossEncoder(self.model_name, device='cpu')
+            logger.info("Re-ranking model loaded successfully")
+        except Exception as e:
+            logger.error(f"Error loading re-ranking model: {str(e)}")
+            raise
+
+    @staticmethod
+    def _pair_key(query: str, text: str) -> str:
+        return hashlib.md5(f"{query}\x00{text}".encode()).hexdigest()
+
+    def rerank(self, queries: List[str], candidates: List[List[Tuple[Document, float]]], top_n: int = None) -> List[List[Tuple[Document, float]]]:
+        top_n = top_n or self.top_n
+        keys = [[self._pair_key(query, doc.page_content) for doc, _ in docs] for query, docs in zip(queries, candidates)]
+
+        # Score every uncached pair of the whole batch in one call to the model
+        with self._lock:
+            missing = {}
+            for query, docs, doc_keys in zip(queries, candidates, keys):
+                for (doc, _), key in zip(docs, doc_keys):
+                    if key not in self._scores and key not in missing:
+                        missing[key] = (query, doc.page_content)
+
+        if missing:
+            scores = self.model.predict(list(missing.values()), batch_size=self.batch_size, show_progress_bar=False)
+            with self._lock:
+                for key, score in zip(missing.keys(), scores):
+                    self._scores[key] = float(score)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+
+        reranked = []
+        with self._lock:
+            for docs, doc_keys in zip(candidates, keys):
+                scored = []
+                for (doc, _), key in zip(docs, doc_keys):
+                    # An entry evicted in the meantime simply ranks last
+                    scored.append((doc, self._scores.get(key, float('-inf'))))
+                    if key in self._scores:
+                        self._scores.move_to_end(key)
+                scored.sort(key=lambda pair: pair[1], reverse=True)
+                reranked.append(scored[:top_n])
+        logger.debug("Re-ranked %d queries, scored %d new pairs", len(queries), len(missing))
+        return reranked
+
+    def clear_cache(self):
+        with self._lock:
+            self._scores.clear()
+        logger.info("Re-ranking score cache cleared")
@@ -0,0 +1,163 @@
+import os
+import atexit
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple, Optional
+import numpy as np
+from langchain_core.documents import Document
+from utils.config_loader import Config
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+class RetrievalCache:
+    def __init__(self, max_size: int = None, persistent: bool = None, db_path: str = None):
+        self.config = Config()
+        self.max_size = max_size if max_size is not None else self.config.get('vector_store_cache_size', 1000)
+        self.persistent = persistent if persistent is not None else self.config.get('retrieval_cache_persistent', True)
+        self.db_path = db_path or os.path.join(self.config.get('cache_dir', 'data/cache/'), 'retrieval_cache.sqlite')
+        self.max_rows = self.config.get('retrieval_cache_max_rows', 200000)
+        self.commit_interval = self.config.get('retrieval_cache_commit_interval', 200)
+        # Every collection keeps its own warm tier of max_size entries, only versions and the disk tier are shared
+        self._memory = {}
+        # Versions are read from disk once per collection, bumps in this process keep them current
+        self._versions = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._connection = None
+        if self.persistent:
+            self._open_database()
+            atexit.register(self.flush)
+
+    def _open_database(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # A lost write after a crash only costs a retrieval, no need to sync every commit
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS collection_versions (collection TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        # Earlier versions stored the full chunk text of every result
+        self._connection.execute("DROP TABLE IF EXISTS results")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS result_ids (collection TEXT, version INTEGER, k INTEGER, query_hash TEXT, "
+            "payload TEXT NOT NULL, PRIMARY KEY (collection, version, k, query_hash))"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def text_key(text: str, model_name: str) -> str:
+        # The embedding of a text is fixed for a given model, so the text can stand in for its vector
+        return 'text:' + hashlib.sha1(f"{model_name}\x00{text}".encode()).hexdigest()
+
+    @staticmethod
+    def vector_key(embedding: np.ndarray) -> str:
+        return 'vector:' + hashlib.sha1(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+
+    def version(self, collection: str) -> int:
+        version = self._versions.get(collection)
+        if version is not None:
+            return version
+        with self._lock:
+            version = 0
+            if self._connection:
+                row = self._connection.execute(
+                    "SELECT version FROM collection_versions WHERE collection = ?", (collection,)
+                ).fetchone()
+                version = row[0] if row else 0
+            return self._versions.setdefault(collection, version)
+
+    def bump_version(self, collection: str) -> int:
+        with self._lock:
+            if self._connection:
+                self._write_pending()
+                self._connection.execute(
+                    "INSERT INTO collection_versions (collection, version) VALUES (?, 1) "
+                    "ON CONFLICT(collection) DO UPDATE SET version = version + 1", (collection,)
+                )
+                version = self._connection.execute(
+                    "SELECT version FROM collection_versions WHERE collection = ?", (collection,)
+                ).fetchone()[0]
+                # Results of older versions can never be served again
+                self._connection.execute("DELETE FROM result_ids WHERE collection = ? AND version < ?", (collection, version))
+                self._connection.commit()
+            else:
+                version = self._versions.get(collection, 0) + 1
+            self._versions[collection] = version
+            self._memory.pop(collection, None)
+        logger.debug("Collection '%s' is now at version %d", collection, version)
+        return version
+
+    def get(self, collection: str, k: int, query_hash: str,
+            resolve: Callable[[List[str]], Dict[str, Document]] = None) -> Optional[List[Tuple[Document, float]]]:
+        key = (collection, self.version(collection), k, query_hash)
+        with self._lock:
+            tier = self._memory.get(collection)
+            if tier is not None and key in tier:
+                tier.move_to_end(key)
+                return list(tier[key])
+            if not self._connection or resolve is None:
+                return None
+            row = self._connection.execute(
+                "SELECT payload FROM result_ids WHERE collection = ? AND version = ? AND k = ? AND query_hash = ?", key
+            ).fetchone()
+        if row is None:
+            return None
+        # Only ids and scores are on disk, the chunks come back from the collection
+        hits = json.loads(row[0])
+        documents = resolve([doc_id for doc_id, _ in hits])
+        if any(doc_id not in documents for doc_id, _ in hits):
+            return None
+        results = tuple((documents[doc_id], score) for doc_id, score in hits)
+        self._remember(key, results)
+        return list(results)
+
+    def put(self, collection: str, k: int, query_hash: str, results: List[Tuple[Document, float]], ids: List[str] = None):
+        key = (collection, self.version(collection), k, query_hash)
+        self._remember(key, tuple(results))
+        if self._connection and ids is not None:
+            payload = json.dumps([[doc_id, float(score)] for doc_id, (_, score) in zip(ids, results)])
+            with self._lock:
+                # Written in batches, one transaction per retrieval would dominate the lookup itself
+                self._pending.append(key + (payload,))
+                if len(self._pending) >= self.commit_interval:
+                    self._write_pending()
+
+    def flush(self):
+        with self._lock:
+            self._write_pending()
+
+    def _write_pending(self):
+        if not self._connection or not self._pending:
+            return
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO result_ids (collection, version, k, query_hash, payload) VALUES (?, ?, ?, ?, ?)",
+            self._pending
+        )
+        self._pending = []
+        # The oldest entries go first once the table is over its cap
+        excess = self._connection.execute("SELECT COUNT(*) FROM result_ids").fetchone()[0] - self.max_rows
+        if excess > 0:
+            self._connection.execute(
+                "DELETE FROM result_ids WHERE rowid IN (SELECT rowid FROM result_ids ORDER BY rowid LIMIT ?)", (excess,)
+            )
+        self._connection.commit()
+
+    def clear(self, collection: str = None):
+        with self._lock:
+            self._write_pending()
+            if collection is None:
+                self._memory.clear()
+            else:
+                self._memory.pop(collection, None)
+
+    def _remember(self, key, results):
+        with self._lock:
+            tier = self._memory.setdefault(key[0], OrderedDict())
+            tier[key] = tuple(results)
+            tier.move_to_end(key)
+            while len(tier) > self.max_size:
+                tier.popitem(last=False)
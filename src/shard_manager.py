@@ -0,0 +1,289 @@
+import os
+import csv
+import json
+import time
+import uuid
+import pickle
+import socket
+import hashlib
+from typing import List, Dict, Optional, Tuple
+from utils.config_loader import Config
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+RESULT_FIELDS = ['row_id', 'item', 'primary_classification', 'classification', 'reasoning', 'confidence']
+
+class ShardManager:
+    def __init__(self, job_dir: str):
+        self.config = Config()
+        self.job_dir = job_dir
+        self.max_attempts = self.config.get('shard_max_attempts', 3)
+        self.lock_timeout = self.config.get('shard_lock_timeout', 3600)
+        self.manifest_path = os.path.join(self.job_dir, 'manifest.json')
+        self.columns_path = os.path.join(self.job_dir, 'columns.pkl')
+
+    def prepare(self, items: List[str], num_shards: int, run_spec: Dict, columns: Dict = None,
+                collections: List[str] = None, fingerprint: Dict = None) -> int:
+        if num_shards < 1:
+            raise ValueError("Number of shards must be at least 1.")
+        num_shards = min(num_shards, max(len(items), 1))
+        os.makedirs(self.job_dir, exist_ok=True)
+
+        for shard_id, (start, end) in enumerate(self.shard_bounds(len(items), num_shards)):
+            if collections is None:
+                rows = [(row_id, items[row_id]) for row_id in range(start, end)]
+                self._write_csv(self._path(shard_id, 'input.csv'), ['row_id', 'item'], rows)
+            else:
+                # Multi-collection runs keep each item's collection next to it
+                rows = [(row_id, items[row_id], collections[row_id]) for row_id in range(start, end)]
+                self._write_csv(self._path(shard_id, 'input.csv'), ['row_id', 'item', 'collection'], rows)
+
+        if columns:
+            # Row ids and passthrough columns are only needed by the merge, workers never read them
+            tmp_path = f"{self.columns_path}.tmp.{os.getpid()}"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(columns, f)
+            os.replace(tmp_path, self.columns_path)
+
+        manifest = {
+            'num_shards': num_shards,
+            'num_items': len(items),
+            'created_at': time.time(),
+            'fingerprint': fingerprint,
+            'run_spec': run_spec
+        }
+        self._atomic_write(self.manifest_path, json.dumps(manifest, indent=2))
+        logger.info(f"Prepared {num_shards} shards for {len(items)} items in {self.job_dir}")
+        return num_shards
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path)
+
+    @staticmethod
+    def fingerprint(file_path: str, num_shards: int) -> Dict:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        stat = os.stat(file_path)
+        return {
+            'input_file': os.path.abspath(file_path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': digest.hexdigest(),
+            'num_shards': num_shards
+        }
+
+    def check_fingerprint(self, fingerprint: Dict):
+        # A new input with the same name must not be merged with the results of an earlier one
+        stored = self.load_manifest().get('fingerprint')
+        if stored is None:
+            raise ValueError(f"The sharded job in {self.job_dir} has no input fingerprint, so it cannot be matched to "
+                             f"{fingerprint['input_file']}. Remove the job directory or use another --job-dir.")
+        changed = [key for key in ('input_file', 'sha256', 'num_shards') if stored.get(key) != fingerprint[key]]
+        if changed:
+            raise ValueError(f"The sharded job in {self.job_dir} was prepared for a different run ({', '.join(changed)} "
+                             f"changed). Remove the job directory or use another --job-dir.")
+
+    @staticmethod
+    def shard_bounds(num_items: int, num_shards: int) -> List[Tuple[int, int]]:
+        return [(i * num_items // num_shards, (i + 1) * num_items // num_shards) for i in range(num_shards)]
+
+    def load_manifest(self) -> Dict:
+        if not os.path.exists(self.manifest_path):
+            raise FileNotFoundError(f"Shard manifest not found: {self.manifest_path}")
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def claim_shard(self, worker_id: str) -> Optional[int]:
+        manifest = self.load_manifest()
+        for shard_id in range(manifest['num_shards']):
+            if self.is_done(shard_id) or self.attempts(shard_id) >= self.max_attempts:
+                continue
+            if self._acquire_lock(shard_id, worker_id):
+                # Another worker may have finished it between the check and the lock
+                if self.is_done(shard_id):
+                    self.release_lock(shard_id)
+                    continue
+                logger.info(f"Worker {worker_id} claimed shard {shard_id}")
+                return shard_id
+        return None
+
+    def read_shard(self, shard_id: int) -> Tuple[List[int], List[str], Optional[List[str]]]:
+        row_ids, items, collections = [], [], []
+        with open(self._path(shard_id, 'input.csv'), 'r', newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            has_collections = 'collection' in (reader.fieldnames or [])
+            for row in reader:
+                row_ids.append(int(row['row_id']))
+                items.append(row['item'])
+                if has_collections:
+                    collections.append(row['collection'])
+        return row_ids, items, collections if has_collections else None
+
+    def heartbeat(self, shard_id: int):
+        try:
+            os.utime(self._path(shard_id, 'lock'))
+        except FileNotFoundError:
+            pass
+
+    def complete_shard(self, shard_id: int, row_ids: List[int], results: List[Dict]):
+        if len(row_ids) != len(results):
+            raise ValueError(f"Mismatch between rows and results in shard {shard_id}.")
+        rows = [[row_id] + [result[field] for field in RESULT_FIELDS[1:]] for row_id, result in zip(row_ids, results)]
+        self._write_csv(self._path(shard_id, 'output.csv'), RESULT_FIELDS, rows)
+        self._atomic_write(self._path(shard_id, 'done'), str(time.time()))
+        self.release_lock(shard_id)
+        logger.info(f"Completed shard {shard_id} with {len(rows)} rows")
+
+    def fail_shard(self, shard_id: int, error: str):
+        attempts = self.attempts(shard_id) + 1
+        self._atomic_write(self._path(shard_id, 'failed'), json.dumps({'attempts': attempts, 'error': error}))
+        self.release_lock(shard_id)
+        logger.error(f"Shard {shard_id} failed (attempt {attempts}/{self.max_attempts}): {error}")
+
+    def release_lock(self, shard_id: int):
+        try:
+            os.remove(self._path(shard_id, 'lock'))
+        except FileNotFoundError:
+            pass
+
+    def is_done(self, shard_id: int) -> bool:
+        return os.path.exists(self._path(shard_id, 'done'))
+
+    def attempts(self, shard_id: int) -> int:
+        failed_path = self._path(shard_id, 'failed')
+        if not os.path.exists(failed_path):
+            return 0
+        with open(failed_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('attempts', 0)
+
+    def reset_failed(self):
+        manifest = self.load_manifest()
+        for shard_id in range(manifest['num_shards']):
+            try:
+                os.remove(self._path(shard_id, 'failed'))
+            except FileNotFoundError:
+                pass
+
+    def status(self) -> Dict[str, List[int]]:
+        manifest = self.load_manifest()
+        status = {'done': [], 'running': [], 'failed': [], 'pending': []}
+        for shard_id in range(manifest['num_shards']):
+            if self.is_done(shard_id):
+                status['done'].append(shard_id)
+            elif os.path.exists(self._path(shard_id, 'lock')):
+                status['running'].append(shard_id)
+            elif self.attempts(shard_id) >= self.max_attempts:
+                status['failed'].append(shard_id)
+            else:
+                status['pending'].append(shard_id)
+        return status
+
+    def merge(self) -> Tuple[List[str], List[Dict]]:
+        manifest = self.load_manifest()
+        status = self.status()
+        if len(status['done']) != manifest['num_shards']:
+            missing = sorted(status['running'] + status['failed'] + status['pending'])
+            raise RuntimeError(f"Cannot merge, {len(missing)} shards are not complete: {missing}")
+
+        merged = {}
+        for shard_id in range(manifest['num_shards']):
+            with open(self._path(shard_id, 'output.csv'), 'r', newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    merged[int(row['row_id'])] = row
+
+        if len(merged) != manifest['num_items']:
+            raise RuntimeError(f"Merged {len(merged)} rows but expected {manifest['num_items']}.")
+
+        items, results = [], []
+        for row_id in range(manifest['num_items']):
+            row = merged[row_id]
+            items.append(row['item'])
+            results.append({
+                'item': row['item'],
+                'primary_classification': row['primary_classification'],
+                'classification': row['classification'],
+                'reasoning': row['reasoning'],
+                'confidence': float(row['confidence'])
+            })
+        logger.info(f"Merged {len(results)} rows from {manifest['num_shards']} shards")
+        return items, results
+
+    def load_columns(self) -> Optional[Dict]:
+        if not os.path.exists(self.columns_path):
+            return None
+        with open(self.columns_path, 'rb') as f:
+            return pickle.load(f)
+
+    @staticmethod
+    def default_worker_id() -> str:
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def _acquire_lock(self, shard_id: int, worker_id: str) -> bool:
+        lock_path = self._path(shard_id, 'lock')
+        if self._create_lock(lock_path, worker_id):
+            return True
+        owner = self._read_lock(lock_path)
+        if owner is None or not self._is_stale(lock_path):
+            return False
+        # The holder stopped sending heartbeats, most likely a crashed worker. Renaming is atomic, so only one
+        # worker moves the stale lock away; deleting it could remove a lock another worker just took over
+        stale_path = f"{lock_path}.stale.{uuid.uuid4().hex}"
+        try:
+            os.rename(lock_path, stale_path)
+        except FileNotFoundError:
+            return False
+        if self._read_lock(stale_path) != owner:
+            # The lock was already taken over between the check and the rename, give it back
+            try:
+                os.link(stale_path, lock_path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        logger.warning(f"Took over stale lock on shard {shard_id} from {owner}")
+        return self._create_lock(lock_path, worker_id)
+
+    @staticmethod
+    def _create_lock(lock_path: str, worker_id: str) -> bool:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        # A unique token tells a new lock apart from the stale one it replaced, even for the same worker
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"{worker_id} {uuid.uuid4().hex}")
+        return True
+
+    @staticmethod
+    def _read_lock(lock_path: str) -> Optional[str]:
+        try:
+            with open(lock_path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _is_stale(self, lock_path: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(lock_path) > self.lock_timeout
+        except FileNotFoundError:
+            return True
+
+    def _path(self, shard_id: int, suffix: str) -> str:
+        return os.path.join(self.job_dir, f"shard_{shard_id:05d}.{suffix}")
+
+    def _write_csv(self, path: str, fieldnames: List[str], rows):
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+            writer.writerows(rows)
+        os.replace(tmp_path, path)
+
+    def _atomic_write(self, path: str, content: str):
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
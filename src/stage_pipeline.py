@@ -0,0 +1,151 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+_END = object()
+
+class Stage:
+    def __init__(self, name: str, fn: Callable, workers: int = 1, batch_size: int = 1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        # Batched stages receive and return a list of payloads
+        self.batch_size = max(1, batch_size)
+        self.batched = batch_size > 1
+
+class StagePipeline:
+    def __init__(self, stages: List[Stage], queue_size: int = 256, poll_interval: float = 0.1, max_in_flight: int = None,
+                 stop_on: Tuple[type, ...] = ()):
+        if not stages:
+            raise ValueError("A stage pipeline needs at least one stage.")
+        self.stages = stages
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        # Items read from the source but not yet yielded, this also bounds the reorder buffer
+        self.max_in_flight = max_in_flight or queue_size + sum(stage.workers * stage.batch_size for stage in stages)
+        # Expected ways to end a run early, they stop the pipeline quietly and reach the caller unwrapped
+        self.stop_on = stop_on
+
+    def run(self, source: Iterable[Any]) -> Iterator[Any]:
+        stop = threading.Event()
+        errors = []
+        # One bounded queue in front of every stage plus one for the results
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+        # A slow item holds back everything after it, so reading stops instead of parking results without limit
+        in_flight = threading.Semaphore(self.max_in_flight)
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=self.poll_interval)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    continue
+            return _END
+
+        def fail(stage_name, error):
+            if isinstance(error, self.stop_on):
+                logger.warning(f"Pipeline stage '{stage_name}' stopped the run: {str(error)}")
+            else:
+                logger.error(f"Error in pipeline stage '{stage_name}': {str(error)}", exc_info=True)
+            errors.append(error)
+            stop.set()
+
+        def read_source():
+            try:
+                for index, payload in enumerate(source):
+                    while not in_flight.acquire(timeout=self.poll_interval):
+                        if stop.is_set():
+                            return
+                    if not put(queues[0], (index, payload)):
+                        return
+            except Exception as e:
+                fail('read', e)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    put(queues[0], _END)
+
+        def work(position, stage):
+            in_queue, out_queue = queues[position], queues[position + 1]
+            finished = False
+            try:
+                while not finished and not stop.is_set():
+                    first = get(in_queue)
+                    if first is _END:
+                        break
+                    batch = [first]
+                    while len(batch) < stage.batch_size:
+                        try:
+                            entry = in_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if entry is _END:
+                            finished = True
+                            break
+                        batch.append(entry)
+
+                    indices = [index for index, _ in batch]
+                    payloads = [payload for _, payload in batch]
+                    if stage.batched:
+                        outputs = stage.fn(payloads)
+                    else:
+                        outputs = [stage.fn(payload) for payload in payloads]
+
+                    for index, output in zip(indices, outputs):
+                        if not put(out_queue, (index, output)):
+                            return
+            except Exception as e:
+                fail(stage.name, e)
+            finally:
+                with remaining_lock:
+                    remaining[position] -= 1
+                    last_worker = remaining[position] == 0
+                if last_worker:
+                    next_workers = self.stages[position + 1].workers if position + 1 < len(self.stages) else 1
+                    for _ in range(next_workers):
+                        put(out_queue, _END)
+
+        threads = [threading.Thread(target=read_source, name="stage-read", daemon=True)]
+        for position, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(target=work, args=(position, stage),
+                                                name=f"stage-{stage.name}-{worker}", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        # Results can finish out of order, hold them back until their turn
+        pending = {}
+        next_index = 0
+        try:
+            while True:
+                entry = get(queues[-1])
+                if entry is _END:
+                    break
+                index, output = entry
+                pending[index] = output
+                while next_index in pending:
+                    output = pending.pop(next_index)
+                    next_index += 1
+                    in_flight.release()
+                    yield output
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            if isinstance(errors[0], self.stop_on):
+                raise errors[0]
+            raise RuntimeError(f"Stage pipeline failed: {str(errors[0])}") from errors[0]
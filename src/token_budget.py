@@ -0,0 +1,124 @@
+import json
+import math
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+from utils.config_loader import Config
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+class BudgetExceeded(RuntimeError):
+    pass
+
+class TokenBudget:
+    def __init__(self, model_name: str, max_tokens: int = None, max_cost: float = None, model_type: str = None):
+        self.config = Config()
+        self.model_name = model_name
+        self.model_type = model_type
+        self.prices = (self.config.get('llm_prices') or {}).get(model_name, {})
+        self.max_tokens = None
+        self.max_cost = None
+        self.set_limits(max_tokens if max_tokens is not None else self.config.get('budget_max_tokens'),
+                        max_cost if max_cost is not None else self.config.get('budget_max_cost'))
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def set_limits(self, max_tokens: int = None, max_cost: float = None):
+        if max_tokens is not None:
+            self.max_tokens = max_tokens
+        if max_cost is not None:
+            # Without a price every call costs nothing and the cap would never stop the run
+            if not self.prices:
+                if self.model_type != 'ollama':
+                    raise ValueError(f"A cost cap needs a price for '{self.model_name}' in llm_prices.")
+                logger.warning(f"Local model '{self.model_name}' has no price, the cost cap never applies")
+            self.max_cost = max_cost
+
+    def record(self, input_tokens: int, output_tokens: int):
+        with self._lock:
+            self.input_tokens += input_tokens or 0
+            self.output_tokens += output_tokens or 0
+            self.calls += 1
+
+    def cost(self, input_tokens: int = None, output_tokens: int = None) -> float:
+        input_tokens = self.input_tokens if input_tokens is None else input_tokens
+        output_tokens = self.output_tokens if output_tokens is None else output_tokens
+        # Prices are per million tokens, unpriced models such as local Ollama ones cost nothing
+        return (input_tokens * self.prices.get('input', 0.0) + output_tokens * self.prices.get('output', 0.0)) / 1e6
+
+    def exceeded(self) -> bool:
+        with self._lock:
+            total = self.input_tokens + self.output_tokens
+        if self.max_tokens is not None and total >= self.max_tokens:
+            return True
+        return self.max_cost is not None and self.cost() >= self.max_cost
+
+    def check(self):
+        # Checked before every model call, calls already in flight still finish
+        if self.exceeded():
+            raise BudgetExceeded(f"Token budget reached after {self.calls} calls "
+                                 f"({self.input_tokens + self.output_tokens} tokens, ${self.cost():.4f})")
+
+    def summary(self) -> str:
+        return (f"{self.calls} model calls, {self.input_tokens} input and {self.output_tokens} output tokens, "
+                f"estimated cost ${self.cost():.4f}")
+
+class TokenEstimator:
+    def __init__(self, model_type: str, model_name: str):
+        self.config = Config()
+        self.model_type = model_type
+        # Only OpenAI publishes its tokenizer, other providers are approximated with a correction factor
+        self.factor = (self.config.get('dry_run_token_factors') or {}).get(model_type, 1.0)
+        self.encoding = None
+        try:
+            import tiktoken
+            try:
+                self.encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding('o200k_base')
+        except Exception as e:
+            # Missing package or an encoding that cannot be downloaded offline
+            self.encoding = None
+            logger.warning(f"tiktoken is not available ({str(e)}), estimating tokens from the character count")
+
+    def count(self, text: str) -> int:
+        tokens = len(self.encoding.encode(text)) if self.encoding else math.ceil(len(text) / 4)
+        return math.ceil(tokens * self.factor)
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        # A few tokens of framing per message, as chat formats add role markers
+        return sum(self.count(message['content']) + 4 for message in messages)
+
+class ResponseCheckpoint:
+    def __init__(self, db_path: str = None):
+        self.config = Config()
+        self.db_path = db_path or os.path.join(self.config.get('cache_dir', 'data/cache/'), 'responses.sqlite')
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+        self._connection.commit()
+
+    @staticmethod
+    def key(model_type: str, model_name: str, messages: List[Dict[str, str]]) -> str:
+        return hashlib.sha1(json.dumps([model_type, model_name, messages], ensure_ascii=False).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connection.execute("SELECT result FROM responses WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, result: Dict):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)", (key, json.dumps(result)))
+            self._connection.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
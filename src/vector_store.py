@@ -1,14 +1,18 @@
 import os
-import shutil
-from typing import List, Dict, Tuple
+import hashlib
+import threading
+from typing import List, Dict, Tuple, Optional
 import numpy as np
 from langchain_chroma import Chroma
 from langchain_core.embeddings import Embeddings
 from langchain_core.documents import Document
+import chromadb
 from chromadb.config import Settings
 from utils.config_loader import Config
 from src.embedding_manager import EmbeddingManager
-from functools import lru_cache
+from src.retrieval_cache import RetrievalCache
+from src.collection_catalog import CollectionCatalog
+from src.lexical_index import LexicalIndex
 from utils.logger import get_logger
 logger = get_logger(__name__)
 
@@ -23,24 +27,40 @@ class CustomEmbeddingFunction(Embeddings):
         return self.embedding_manager.encode([text])[0].tolist()
 
 class VectorStore:
-    def __init__(self, default_collection_name='default'):
+    def __init__(self, default_collection_name='default', embedding_manager: EmbeddingManager = None, client=None, catalog: CollectionCatalog = None,
+                 lexical_index: LexicalIndex = None, retrieval_cache: RetrievalCache = None):
         self.config = Config()
         self.chroma_db_dir = self.config.chroma_db_dir
-        self.embedding_manager = EmbeddingManager()
+        self.embedding_manager = embedding_manager or EmbeddingManager()
         self.embedding_function = CustomEmbeddingFunction(self.embedding_manager)
+        # One client per process, collections opened later reuse it instead of starting a new one
+        self.client = client or chromadb.PersistentClient(
+            path=self.chroma_db_dir,
+            settings=Settings(anonymized_telemetry=False, is_persistent=True)
+        )
+        self.catalog = catalog or CollectionCatalog()
+        self.lexical_enabled = self.config.get('lexical_index_enabled', True)
+        self.hybrid_search = self.lexical_enabled and self.config.get('hybrid_search_enabled', True)
+        self.rrf_k = self.config.get('hybrid_rrf_k', 60)
+        self.lexical_index = (lexical_index or LexicalIndex()) if self.lexical_enabled else None
+        self._lexical_checked = False
+        self._lexical_lock = threading.Lock()
         self.vector_store = None
         self.current_collection_name = default_collection_name
         self.cache_size = self.config.get('vector_store_cache_size', 1000)
+        self.retrieval_cache = retrieval_cache or RetrievalCache(max_size=self.cache_size)
         self.initialize_vector_store(self.current_collection_name)
 
     def initialize_vector_store(self, collection_name):
         logger.info(f"Initializing vector store with collection: {collection_name}")
         try:
+            # HNSW settings only apply to new collections, get_or_create would overwrite the stored metadata of an existing one
+            exists = collection_name in {collection.name for collection in self.client.list_collections()}
             self.vector_store = Chroma(
-                persist_directory=self.chroma_db_dir,
+                client=self.client,
                 collection_name=collection_name,
                 embedding_function=self.embedding_function,
-                client_settings=Settings(anonymized_telemetry=False)
+                collection_metadata=None if exists else self.hnsw_metadata()
             )
             logger.info(f"Initialized vector store at {self.chroma_db_dir} with collection {collection_name}")
         except Exception as e:
@@ -50,67 +70,262 @@ class VectorStore:
     def switch_collection(self, collection_name):
         logger.info(f"Switching to collection: {collection_name}")
         self.current_collection_name = collection_name
+        self._lexical_checked = False
         self.initialize_vector_store(collection_name)
 
     def reset_vector_store(self):
         logger.info("Resetting vector store")
         try:
-            if os.path.exists(self.chroma_db_dir):
-                shutil.rmtree(self.chroma_db_dir)
-                logger.info(f"Removed existing vector store at {self.chroma_db_dir}")
+            # Delete through the client, removing the files under a live Chroma system leaves its data in place
+            client = self.client
+            for collection in client.list_collections():
+                client.delete_collection(collection.name)
+                self.retrieval_cache.bump_version(collection.name)
+                self.catalog.remove_collection(collection.name)
+                if self.lexical_index:
+                    self.lexical_index.remove_collection(collection.name)
+            logger.info(f"Removed existing collections from the vector store at {self.chroma_db_dir}")
             os.makedirs(self.chroma_db_dir, exist_ok=True)
             self.initialize_vector_store(self.current_collection_name)
         except Exception as e:
             logger.error(f"Error resetting vector store: {str(e)}")
             raise RuntimeError(f"Failed to reset vector store: {str(e)}")
 
+    def hnsw_metadata(self, **overrides) -> Dict:
+        # HNSW parameters only take effect when a collection is created
+        params = {
+            'hnsw:space': self.config.get('hnsw_space', 'cosine'),
+            'hnsw:M': self.config.get('hnsw_m', 16),
+            'hnsw:construction_ef': self.config.get('hnsw_construction_ef', 200),
+            'hnsw:search_ef': self.config.get('hnsw_search_ef', 64),
+            'hnsw:num_threads': self.config.get('hnsw_num_threads', 4)
+        }
+        params.update(overrides)
+        return params
+
+    def max_batch_size(self) -> int:
+        configured = self.config.get('vector_store_max_batch_size', 5000)
+        try:
+            return min(configured, self.client.get_max_batch_size())
+        except AttributeError:
+            return configured
+
     def store_documents(self, processed_documents: List[Document], embeddings: np.ndarray = None):
         logger.info(f"Storing {len(processed_documents)} documents in ChromaDB collection '{self.current_collection_name}'")
         try:
             texts = [doc.page_content for doc in processed_documents]
             metadatas = [doc.metadata for doc in processed_documents]
-            ids = [str(i) for i in range(len(processed_documents))]
+            ids = [self._document_id(doc) for doc in processed_documents]
             
-            if embeddings is not None:
-                embeddings = embeddings.tolist()
+            if embeddings is None:
+                embeddings = self.embedding_manager.encode(texts, show_progress=False)
             
-            self.vector_store.add_texts(
-                texts=texts,
-                metadatas=metadatas,
-                ids=ids,
-                embeddings=embeddings
-            )
+            self.bulk_load(ids, texts, metadatas, embeddings)
             
             logger.info(f"Stored {len(processed_documents)} documents in ChromaDB collection '{self.current_collection_name}'")
         except Exception as e:
             logger.error(f"Error storing documents in vector store: {str(e)}")
             raise RuntimeError(f"Failed to store documents: {str(e)}")
 
-    @lru_cache(maxsize=1000)
-    def _cached_similarity_search(self, query: str, k: int) -> Tuple[Document, float]:
-        results = self.vector_store.similarity_search_with_score(query, k=k)
-        return tuple(results)  # Convert list to tuple for hashability
+    def bulk_load(self, ids: List[str], texts: List[str], metadatas: List[Dict], embeddings: np.ndarray, collection=None):
+        if not (len(ids) == len(texts) == len(metadatas) == len(embeddings)):
+            raise ValueError("ids, texts, metadatas and embeddings must have the same length.")
+
+        # Write straight to the Chroma collection in batches it accepts, skipping langchain's list conversion
+        own_collection = collection is None
+        collection = collection or self.vector_store._collection
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        batch_size = self.max_batch_size()
+        if own_collection:
+            self.collection_stats()
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            if own_collection:
+                # Only ids the collection does not hold yet change the catalog counts, an id lookup is cheap
+                existing = set(collection.get(ids=ids[start:end], include=[])['ids'])
+                added = self._source_counts(
+                    metadata for doc_id, metadata in zip(ids[start:end], metadatas[start:end]) if doc_id not in existing
+                )
+            collection.upsert(
+                ids=ids[start:end],
+                documents=texts[start:end],
+                metadatas=[metadata or None for metadata in metadatas[start:end]],
+                embeddings=embeddings[start:end]
+            )
+            if own_collection:
+                self.catalog.record_added(self.current_collection_name, added, self.embedding_manager.model_name, int(embeddings.shape[1]))
+                if self.lexical_index:
+                    self.lexical_index.add(self.current_collection_name, ids[start:end], texts[start:end])
+        if own_collection:
+            self.retrieval_cache.bump_version(self.current_collection_name)
+        logger.debug("Bulk loaded %d vectors in batches of %d", len(ids), batch_size)
+
+    def filter_changed_documents(self, documents: List[Document]) -> List[Document]:
+        # Re-ingesting an unchanged library should neither re-embed nor invalidate cached retrievals
+        ids = [self._document_id(doc) for doc in documents]
+        existing = self.vector_store._collection.get(ids=ids, include=['documents'])
+        stored = dict(zip(existing['ids'], existing['documents']))
+        return [doc for doc, doc_id in zip(documents, ids) if stored.get(doc_id) != doc.page_content]
+
+    def chunk_ids_by_source(self) -> Dict[str, List[str]]:
+        # Chunk ids are '<file name>:<position>', so the chunks of a file are found without reading their metadata
+        sources = {}
+        for doc_id in self.vector_store._collection.get(include=[])['ids']:
+            source, _, index = doc_id.rpartition(':')
+            if source and index.isdigit():
+                sources.setdefault(source, []).append(doc_id)
+        return sources
+
+    def delete_documents(self, ids: List[str]):
+        logger.info(f"Deleting {len(ids)} documents from collection '{self.current_collection_name}'")
+        try:
+            self.collection_stats()
+            stored = self.vector_store._collection.get(ids=ids, include=['metadatas'])
+            self.vector_store._collection.delete(ids=ids)
+            self.catalog.record_removed(self.current_collection_name, self._source_counts(stored['metadatas']))
+            if self.lexical_index:
+                self.lexical_index.remove(self.current_collection_name, ids)
+            self.retrieval_cache.bump_version(self.current_collection_name)
+        except Exception as e:
+            logger.error(f"Error deleting documents: {str(e)}")
+            raise RuntimeError(f"Failed to delete documents: {str(e)}")
+
+    @staticmethod
+    def _source_counts(metadatas) -> Dict[str, int]:
+        counts = {}
+        for metadata in metadatas:
+            source = CollectionCatalog.source_of(metadata)
+            counts[source] = counts.get(source, 0) + 1
+        return counts
+
+    @staticmethod
+    def _document_id(doc: Document) -> str:
+        # Stable ids make re-ingesting the same chunks an upsert instead of a duplicate
+        if 'chunk_id' in doc.metadata:
+            return str(doc.metadata['chunk_id'])
+        return hashlib.md5(doc.page_content.encode()).hexdigest()
 
     def similarity_search(self, query: str, k: int = None) -> List[Tuple[Document, float]]:
         if k is None:
             k = self.config.get('similarity_search_k', 5)
-        logger.info(f"Performing similarity search for query: {query}")
+        logger.debug("Performing similarity search for query: %s", query)
         try:
-            results = self._cached_similarity_search(query, k)
-            return list(results)  # Convert back to list
+            results = self.get_cached_results(query, k)
+            if results is None:
+                embedding = self.embedding_manager.encode([query], show_progress=False)[0]
+                results = self.similarity_search_by_vector(embedding, k, query=query)
+            return results
         except Exception as e:
             logger.error(f"Error performing similarity search: {str(e)}")
             raise RuntimeError(f"Failed to perform similarity search: {str(e)}")
 
+    def _text_key(self, query: str) -> str:
+        # Hybrid and dense-only results for the same query must not share a cache entry
+        model_key = f"{self.embedding_manager.model_name}:hybrid" if self.hybrid_search else self.embedding_manager.model_name
+        return RetrievalCache.text_key(query, model_key)
+
+    def get_cached_results(self, query: str, k: int) -> Optional[List[Tuple[Document, float]]]:
+        return self.retrieval_cache.get(self.current_collection_name, k, self._text_key(query), self._documents_by_id)
+
+    def similarity_search_by_vector(self, embedding: np.ndarray, k: int = None, query: str = None) -> List[Tuple[Document, float]]:
+        if k is None:
+            k = self.config.get('similarity_search_k', 5)
+        if query is not None:
+            query_hash = self._text_key(query)
+        else:
+            query_hash = RetrievalCache.vector_key(embedding)
+        try:
+            results = self.retrieval_cache.get(self.current_collection_name, k, query_hash, self._documents_by_id)
+            if results is None:
+                embedding = embedding.tolist() if isinstance(embedding, np.ndarray) else list(embedding)
+                results = self.vector_store.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+                if self.hybrid_search and query is not None:
+                    results = self._fuse(results, self.lexical_search(query, k), k)
+                self.retrieval_cache.put(self.current_collection_name, k, query_hash, results,
+                                         [self._document_id(doc) for doc, _ in results])
+            return results
+        except Exception as e:
+            logger.error(f"Error performing similarity search by vector: {str(e)}")
+            raise RuntimeError(f"Failed to perform similarity search: {str(e)}")
+
+    def lexical_search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        self._ensure_lexical_index()
+        hits = self.lexical_index.search(self.current_collection_name, query, k)
+        if not hits:
+            return []
+        documents = self._documents_by_id([doc_id for doc_id, _ in hits])
+        return [(documents[doc_id], score) for doc_id, score in hits if doc_id in documents]
+
+    def _documents_by_id(self, ids: List[str]) -> Dict[str, Document]:
+        stored = self.vector_store._collection.get(ids=ids, include=['documents', 'metadatas'])
+        return {
+            doc_id: Document(page_content=text, metadata=metadata or {})
+            for doc_id, text, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'])
+        }
+
+    def _fuse(self, dense: List[Tuple[Document, float]], lexical: List[Tuple[Document, float]], k: int) -> List[Tuple[Document, float]]:
+        # Reciprocal rank fusion, the two score scales are not comparable but their ranks are
+        fused = {}
+        for ranking in (dense, lexical):
+            for rank, (doc, _) in enumerate(ranking, 1):
+                key = doc.metadata.get('chunk_id') or doc.page_content
+                entry = fused.setdefault(key, [doc, 0.0])
+                entry[1] += 1.0 / (self.rrf_k + rank)
+        ranked = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)
+        return [(doc, score) for doc, score in ranked[:k]]
+
+    def exact_match(self, item: str) -> Optional[Dict]:
+        if not self.lexical_index:
+            return None
+        self._ensure_lexical_index()
+        return self.lexical_index.exact_match(self.current_collection_name, item)
+
+    def _ensure_lexical_index(self):
+        # Chunks stored before the lexical index existed are skipped by re-ingestion, so index them once here
+        with self._lexical_lock:
+            if self._lexical_checked:
+                return
+            collection = self.vector_store._collection
+            if self.lexical_index.doc_count(self.current_collection_name) != self.get_document_count():
+                logger.info(f"Building the lexical index for collection '{self.current_collection_name}'")
+                self.lexical_index.remove_collection(self.current_collection_name)
+                batch_size = self.max_batch_size()
+                for offset in range(0, collection.count(), batch_size):
+                    page = collection.get(include=['documents'], limit=batch_size, offset=offset)
+                    self.lexical_index.add(self.current_collection_name, page['ids'], page['documents'])
+            self._lexical_checked = True
+
     def get_document_count(self):
         try:
-            return len(self.vector_store.get()['ids'])
+            return self.collection_stats()['chunk_count']
         except Exception as e:
             logger.error(f"Error getting document count: {str(e)}")
             raise RuntimeError(f"Failed to get document count: {str(e)}")
 
+    def collection_stats(self) -> Dict:
+        stats = self.catalog.stats(self.current_collection_name)
+        if stats is None:
+            self._rebuild_catalog()
+            stats = self.catalog.stats(self.current_collection_name)
+        return stats
+
+    def _rebuild_catalog(self):
+        # One paged scan for collections written before the catalog existed, later reads never scan
+        collection = self.vector_store._collection
+        counts, dimension = {}, None
+        batch_size = self.max_batch_size()
+        for offset in range(0, collection.count(), batch_size):
+            page = collection.get(include=['metadatas'], limit=batch_size, offset=offset)
+            for source, count in self._source_counts(page['metadatas']).items():
+                counts[source] = counts.get(source, 0) + count
+        if counts:
+            sample = collection.peek(1)['embeddings']
+            dimension = len(sample[0]) if sample is not None and len(sample) else None
+        self.catalog.rebuild(self.current_collection_name, counts, self.embedding_manager.model_name if counts else None, dimension)
+
     def clear_cache(self):
-        self._cached_similarity_search.cache_clear()
+        # The cache can be shared with other collections of the registry
+        self.retrieval_cache.clear(self.current_collection_name)
         logger.info("Similarity search cache cleared")
 
 # Example usage
@@ -0,0 +1,176 @@
+import os
+import csv
+import json
+import argparse
+from typing import List, Dict
+import numpy as np
+import yaml
+from utils.config_loader import Config
+from utils.json_parser import extract_json_object
+from models.prompts import CATEGORY_EXTRACTION_PROMPT
+from src.embedding_manager import EmbeddingManager
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+class ZeroShotClassifier:
+    def __init__(self, embedding_manager: EmbeddingManager, collection_name: str = None):
+        self.config = Config()
+        self.embedding_manager = embedding_manager
+        self.collection_name = collection_name or self.config.collection_name
+        self.categories_file = self.config.get('zero_shot_categories_file')
+        if self.categories_file:
+            # A '{collection}' placeholder gives every spec book its own list in multi-collection runs
+            self.categories_file = self.categories_file.replace('{collection}', self.collection_name)
+        self.extracted_file = os.path.join(self.config.get('cache_dir', 'data/cache/'), f"categories_{self.collection_name}.json")
+        self.temperature = self.config.get('zero_shot_temperature', 0.05)
+        self.min_confidence = self.config.get('zero_shot_min_confidence', 0.6)
+        self.min_margin = self.config.get('zero_shot_min_margin', 0.02)
+        self.batch_size = self.config.get('zero_shot_batch_size', 1024)
+        self.categories = []
+        self.category_matrix = None
+
+    def has_categories(self) -> bool:
+        return bool(self.categories) or self._categories_path() is not None
+
+    def _categories_path(self):
+        for path in (self.categories_file, self.extracted_file):
+            if path and os.path.exists(path):
+                return path
+        return None
+
+    def load_categories(self, vector_store=None, llm=None) -> List[Dict[str, str]]:
+        path = self._categories_path()
+        can_extract = vector_store is not None and llm is not None
+        if path:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.categories = self._normalize_categories(yaml.safe_load(f))
+            logger.info(f"Loaded {len(self.categories)} categories from {path}")
+            # Earlier versions could cache an empty extraction, extract again instead of failing on it
+            if not self.categories and path == self.extracted_file and can_extract:
+                self.categories = self.extract_categories(vector_store, llm)
+        elif can_extract:
+            self.categories = self.extract_categories(vector_store, llm)
+        else:
+            raise ValueError("No category list available. Set zero_shot_categories_file or provide an LLM to extract the categories.")
+
+        if not self.categories:
+            raise ValueError("The category list is empty.")
+        self._embed_categories()
+        return self.categories
+
+    def extract_categories(self, vector_store, llm) -> List[Dict[str, str]]:
+        # Runs once per collection, the result is cached next to the other caches
+        sample_size = self.config.get('zero_shot_extraction_chunks', 200)
+        max_chars = self.config.get('zero_shot_extraction_max_chars', 24000)
+        documents = vector_store.vector_store._collection.get(include=['documents'], limit=sample_size)['documents']
+        context = "\n\n".join(documents)[:max_chars]
+        logger.info(f"Extracting categories from {len(documents)} chunks of collection '{self.collection_name}'")
+
+        messages = [
+            {"role": "system", "content": CATEGORY_EXTRACTION_PROMPT.format(context=context)},
+            {"role": "user", "content": "List the categories."}
+        ]
+        categories = self._normalize_categories(extract_json_object(llm.invoke(messages, max_output_tokens=self.config.get('zero_shot_extraction_max_tokens', 4096))).get('categories', []))
+        # An empty cache file would be loaded on every later run, so nothing is written
+        if not categories:
+            raise ValueError(f"The LLM returned no categories for collection '{self.collection_name}'. "
+                             f"Set zero_shot_categories_file or check the model response.")
+
+        os.makedirs(os.path.dirname(self.extracted_file), exist_ok=True)
+        with open(self.extracted_file, 'w', encoding='utf-8') as f:
+            json.dump(categories, f, indent=2, ensure_ascii=False)
+        logger.info(f"Extracted {len(categories)} categories to {self.extracted_file}")
+        return categories
+
+    @staticmethod
+    def _normalize_categories(raw) -> List[Dict[str, str]]:
+        # Accepts a list of {name, description} entries, a list of names or a name -> description mapping
+        if isinstance(raw, dict):
+            raw = raw.get('categories', [{'name': name, 'description': description} for name, description in raw.items()])
+        categories = []
+        for entry in raw or []:
+            if isinstance(entry, str):
+                entry = {'name': entry, 'description': ''}
+            name = str(entry.get('name', '')).strip()
+            if name:
+                categories.append({'name': name, 'description': str(entry.get('description') or '').strip()})
+        return categories
+
+    def _embed_categories(self):
+        texts = [f"{c['name']}: {c['description']}" if c['description'] else c['name'] for c in self.categories]
+        matrix = self.embedding_manager.encode(texts, show_progress=False).astype(np.float32)
+        self.category_matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    def scores(self, embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings @ self.category_matrix.T
+
+    def classify(self, items: List[str], embeddings: np.ndarray) -> List[Dict]:
+        similarities = self.scores(embeddings)
+        probabilities = self._softmax(similarities / self.temperature)
+
+        results = []
+        top_two = np.argsort(-similarities, axis=1)[:, :2]
+        for item, sims, probs, ranked in zip(items, similarities, probabilities, top_two):
+            best = ranked[0]
+            runner_up = ranked[1] if len(ranked) > 1 else best
+            margin = float(sims[best] - sims[runner_up])
+            name = self.categories[best]['name']
+            results.append({
+                'item': item,
+                'primary_classification': name,
+                'classification': name,
+                'reasoning': (f"Embedding similarity {sims[best]:.3f} to '{name}', "
+                              f"runner-up '{self.categories[runner_up]['name']}' at {sims[runner_up]:.3f}"),
+                'confidence': float(probs[best]),
+                'ambiguous': bool(probs[best] < self.min_confidence or (runner_up != best and margin < self.min_margin))
+            })
+        return results
+
+    def classify_texts(self, items: List[str]) -> List[Dict]:
+        results = []
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            results.extend(self.classify(batch, self.embedding_manager.encode(batch, show_progress=False)))
+        return results
+
+    def fit_temperature(self, items: List[str], labels: List[str]) -> float:
+        # Picks the softmax temperature that minimises the negative log-likelihood of known labels
+        index = {c['name']: i for i, c in enumerate(self.categories)}
+        known = [(item, index[label]) for item, label in zip(items, labels) if label in index]
+        if not known:
+            raise ValueError("None of the labels match a category name.")
+        similarities = self.scores(self.embedding_manager.encode([item for item, _ in known], show_progress=False))
+        targets = np.array([target for _, target in known])
+
+        best_temperature, best_loss = self.temperature, float('inf')
+        for temperature in np.geomspace(0.005, 1.0, 60):
+            probabilities = self._softmax(similarities / temperature)
+            loss = -float(np.mean(np.log(probabilities[np.arange(len(targets)), targets] + 1e-12)))
+            if loss < best_loss:
+                best_temperature, best_loss = float(temperature), loss
+        accuracy = float(np.mean(np.argmax(similarities, axis=1) == targets))
+        logger.info(f"Fitted temperature {best_temperature:.4f} (NLL {best_loss:.4f}, accuracy {accuracy:.3f}) on {len(known)} labels")
+        self.temperature = best_temperature
+        return best_temperature
+
+    @staticmethod
+    def _softmax(logits: np.ndarray) -> np.ndarray:
+        logits = logits - logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+# Example usage
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the zero-shot confidence temperature on labelled items.")
+    parser.add_argument("labels_file", help="CSV file with 'item' and 'label' columns")
+    args = parser.parse_args()
+
+    with open(args.labels_file, 'r', newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+
+    classifier = ZeroShotClassifier(EmbeddingManager())
+    classifier.load_categories()
+    temperature = classifier.fit_temperature([row['item'] for row in rows], [row['label'] for row in rows])
+    print(f"\nSet zero_shot_temperature: {temperature:.4f} in config/config.yaml")
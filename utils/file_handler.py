@@ -3,61 +3,68 @@ import pandas as pd
 import csv
 from utils.logger import get_logger
 from utils.config_loader import config
+from src.token_budget import BudgetExceeded
 
 logger = get_logger(__name__)
 
+ROW_ID_COLUMN = 'Row_ID'
+RESULT_COLUMNS = ['Item', 'Primary_Classification', 'Overall_Classification', 'Reasoning', 'Confidence']
+COLUMNAR_EXTENSIONS = ('.parquet', '.arrow', '.feather')
+
 class FileHandler:
     def __init__(self):
         self.input_path = config.input_data_path
         self.output_path = config.output_data_path
+        self.output_format = config.get('output_format', 'csv')
+        self.passthrough_columns = config.get('passthrough_columns') or []
+        self.row_group_size = config.get('parquet_row_group_size', 100000)
+        # Headless runs fail on a missing sheet or column instead of prompting
+        self.interactive = not config.get('headless', False)
 
-    def get_input_file(self):
+    def get_input_files(self, names=None):
         if not os.path.exists(self.input_path):
             raise FileNotFoundError(f"Input directory not found: {self.input_path}")
 
-        files = os.listdir(self.input_path)
-        valid_extensions = ('.csv', '.xls', '.xlsx')
+        files = sorted(os.listdir(self.input_path))
+        valid_extensions = ('.csv', '.xls', '.xlsx') + COLUMNAR_EXTENSIONS
         valid_files = [f for f in files if f.endswith(valid_extensions)]
 
+        if names:
+            # A run spec listing files restricts the run to those files
+            missing = [name for name in names if name not in valid_files]
+            if missing:
+                raise ValueError(f"Input files not found in {self.input_path}: {', '.join(missing)}")
+            valid_files = [f for f in valid_files if f in names]
+
         if not valid_files:
             raise ValueError(f"No valid input files found. Supported formats: {', '.join(valid_extensions)}")
 
-        if len(valid_files) > 1:
-            logger.error("Multiple input files found. Please ensure only one input file is present.")
-            raise ValueError("Multiple input files found.")
-
-        input_file = valid_files[0]
-        return os.path.join(self.input_path, input_file)
+        logger.info(f"Found {len(valid_files)} input files: {', '.join(valid_files)}")
+        return [os.path.join(self.input_path, f) for f in valid_files]
 
-    def read_input_file(self, file_path):
+    def read_input_file(self, file_path, extra_columns=None, sheet=None, column=None):
+        # Returns the items, the chosen column, the sheet and the columns carried to the output (row ids, passthrough and extra columns)
+        if file_path.endswith(COLUMNAR_EXTENSIONS):
+            return self._read_columnar_file(file_path, extra_columns, column)
         try:
+            # Only empty cells are missing, text such as 'NA' or 'nan' is a value
             if file_path.endswith('.csv'):
-                df = pd.read_csv(file_path, dtype=str)
+                df = pd.read_csv(file_path, dtype=str, keep_default_na=False, na_values=[''])
                 sheets = None
             else:
                 xl = pd.ExcelFile(file_path)
                 sheets = xl.sheet_names
-                print("Available sheets:")
-                for i, sheet in enumerate(sheets):
-                    print(f"{i + 1}. {sheet}")
-                sheet_index = int(input("Enter the number of the sheet to use: ")) - 1
-                df = xl.parse(sheets[sheet_index], dtype=str)
+                sheet_name = self._choose(sheets, sheet, 'sheet')
+                df = xl.parse(sheet_name, dtype=str, keep_default_na=False, na_values=[''])
 
             if df.empty:
                 raise ValueError(f"The file {file_path} is empty.")
 
-            print("\nAvailable columns:")
-            for i, column in enumerate(df.columns):
-                print(f"{i + 1}. {column}")
-            column_index = int(input("Enter the number of the column to use: ")) - 1
-
-            if column_index < 0 or column_index >= len(df.columns):
-                raise ValueError("Invalid column index.")
-
-            chosen_column = df.columns[column_index]
+            chosen_column = self._choose(list(df.columns), column, 'column')
             
-            df[chosen_column] = df[chosen_column].astype(str)
+            # Missing cells have to go before the conversion, which would turn them into the string 'nan'
             df = df.dropna(subset=[chosen_column])
+            df[chosen_column] = df[chosen_column].astype(str)
             df = df[df[chosen_column].str.strip() != '']
 
             if df.empty:
@@ -66,7 +73,13 @@ class FileHandler:
             logger.info(f"Read {len(df)} rows from {file_path}")
             logger.info(f"Chosen column: {chosen_column}")
 
-            return df[chosen_column].tolist(), chosen_column, sheets[sheet_index] if sheets else None
+            sheet_name = sheet_name if sheets else None
+            carried = self._carried_columns(file_path, list(df.columns), extra_columns)
+            # The index still holds each row's position in the input, empty items were only filtered out
+            columns = {ROW_ID_COLUMN: df.index.tolist()}
+            # Empty cells stay empty in the output instead of becoming 'nan'
+            columns.update({column: [None if pd.isna(value) else str(value) for value in df[column]] for column in carried})
+            return df[chosen_column].tolist(), chosen_column, sheet_name, columns
 
         except pd.errors.EmptyDataError:
             raise ValueError(f"The file {file_path} is empty.")
@@ -76,31 +89,183 @@ class FileHandler:
             logger.error(f"Error reading input file: {str(e)}")
             raise
 
-    def write_results(self, items, results, chosen_column):
+    def _read_columnar_file(self, file_path, extra_columns=None, column=None):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+
+        try:
+            if file_path.endswith('.parquet'):
+                names = pq.read_schema(file_path).names
+            else:
+                # Only the footer is read, reading the table here would decompress every column
+                try:
+                    names = pa.ipc.open_file(pa.memory_map(file_path)).schema.names
+                except pa.ArrowInvalid:
+                    # Feather V1 files are not in the IPC file format
+                    names = feather.read_table(file_path, memory_map=True).schema.names
+
+            chosen_column = self._choose(names, column, 'column')
+            carried = self._carried_columns(file_path, names, extra_columns)
+            # Only the item column and the carried columns are read from disk
+            projection = list(dict.fromkeys([chosen_column] + carried))
+            if file_path.endswith('.parquet'):
+                table = pq.read_table(file_path, columns=projection)
+            else:
+                table = feather.read_table(file_path, columns=projection, memory_map=True)
+
+            if table.num_rows == 0:
+                raise ValueError(f"The file {file_path} is empty.")
+
+            item_column = pc.cast(table.column(chosen_column), pa.string())
+            keep = pc.and_(pc.is_valid(item_column), pc.not_equal(pc.utf8_trim_whitespace(item_column), ''))
+            row_ids = pc.indices_nonzero(pc.fill_null(keep, False))
+            table = table.take(row_ids)
+            if table.num_rows == 0:
+                raise ValueError(f"No valid data found in the chosen column '{chosen_column}'.")
+
+            logger.info(f"Read {table.num_rows} rows from {file_path}")
+            logger.info(f"Chosen column: {chosen_column}")
+
+            columns = {ROW_ID_COLUMN: pc.cast(row_ids, pa.int64())}
+            for column in carried:
+                # Extra columns drive the classification and are used as plain strings, passthrough columns keep their type
+                if extra_columns and column in extra_columns:
+                    columns[column] = [str(value) for value in table.column(column).to_pylist()]
+                else:
+                    columns[column] = table.column(column)
+            return pc.cast(table.column(chosen_column), pa.string()).to_pylist(), chosen_column, None, columns
+        except Exception as e:
+            logger.error(f"Error reading input file: {str(e)}")
+            raise
+
+    def _choose(self, options, selected, kind):
+        # A configured sheet or column may be given by name or by its 1-based number
+        if selected is not None:
+            if isinstance(selected, int) and 1 <= selected <= len(options):
+                return options[selected - 1]
+            if selected in options:
+                return selected
+            raise ValueError(f"The {kind} '{selected}' was not found. Available: {', '.join(map(str, options))}")
+        if not self.interactive:
+            raise ValueError(f"No {kind} given for a headless run. Available: {', '.join(map(str, options))}")
+
+        print(f"\nAvailable {kind}s:")
+        for i, option in enumerate(options):
+            print(f"{i + 1}. {option}")
+        index = int(input(f"Enter the number of the {kind} to use: ")) - 1
+
+        if index < 0 or index >= len(options):
+            raise ValueError(f"Invalid {kind} index.")
+        return options[index]
+
+    def _carried_columns(self, file_path, available, extra_columns=None):
+        carried = list(dict.fromkeys(list(self.passthrough_columns) + list(extra_columns or [])))
+        missing = [column for column in carried if column not in available]
+        if missing:
+            raise ValueError(f"Columns not found in {file_path}: {', '.join(missing)}")
+        return carried
+
+    def write_results(self, items, results, chosen_column, columns=None, output_name='classification_results'):
         if len(items) != len(results):
             raise ValueError("Mismatch between number of items and results.")
 
-        output_file_path = os.path.join(self.output_path, 'classification_results.csv')
+        self.write_results_stream(zip(items, results), chosen_column, columns, output_name)
+
+    def write_results_stream(self, item_results, chosen_column, columns=None, output_name='classification_results'):
+        columns = columns or {}
+        if self.output_format == 'parquet':
+            return self._write_parquet_stream(item_results, columns, output_name)
+
+        output_file_path = os.path.join(self.output_path, f'{output_name}.csv')
         logger.info(f"Writing results to {output_file_path}")
 
         try:
+            row_count = 0
+            values = {name: column.to_pylist() if hasattr(column, 'to_pylist') else column for name, column in columns.items()}
             with open(output_file_path, 'w', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['Item', 'Primary_Classification', 'Overall_Classification', 'Reasoning', 'Confidence']
+                fieldnames = list(values) + RESULT_COLUMNS
                 writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 
                 writer.writeheader()
-                for item, result in zip(items, results):
-                    writer.writerow({
-                        'Item': item,
-                        'Primary_Classification': result['primary_classification'],
-                        'Overall_Classification': result['classification'],
-                        'Reasoning': result['reasoning'],
-                        'Confidence': result['confidence']
-                    })
-
-            logger.info(f"Results successfully written to {output_file_path}")
+                for index, (item, result) in enumerate(item_results):
+                    row = {name: column[index] for name, column in values.items()}
+                    row.update(self._result_row(item, result))
+                    writer.writerow(row)
+                    row_count += 1
+
+            logger.info(f"{row_count} results successfully written to {output_file_path}")
+        except BudgetExceeded:
+            # The run was stopped, not the write, and the rows classified so far are in the file
+            logger.info(f"{row_count} results written to {output_file_path} before the budget stopped the run")
+            raise
         except Exception as e:
             logger.error(f"Error writing results to CSV: {str(e)}")
             raise
 
+    @staticmethod
+    def _result_row(item, result):
+        return {
+            'Item': item,
+            'Primary_Classification': result['primary_classification'],
+            'Overall_Classification': result['classification'],
+            'Reasoning': result['reasoning'],
+            'Confidence': result['confidence']
+        }
+
+    def _write_parquet_stream(self, item_results, columns, output_name):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        output_file_path = os.path.join(self.output_path, f'{output_name}.parquet')
+        logger.info(f"Writing results to {output_file_path}")
+
+        # Carried columns keep their input type, columns read from CSV or Excel are strings
+        fields = []
+        for name, column in columns.items():
+            if isinstance(column, (pa.Array, pa.ChunkedArray)):
+                fields.append(pa.field(name, column.type))
+            else:
+                fields.append(pa.field(name, pa.int64() if name == ROW_ID_COLUMN else pa.string()))
+        fields += [pa.field(name, pa.float64() if name == 'Confidence' else pa.string()) for name in RESULT_COLUMNS]
+        schema = pa.schema(fields)
+
+        try:
+            row_count = 0
+            with pq.ParquetWriter(output_file_path, schema) as writer:
+                def write_row_group(rows):
+                    # One row group per flush, so memory stays bounded by parquet_row_group_size
+                    arrays = []
+                    for field in schema:
+                        if field.name in columns:
+                            arrays.append(pa.array(columns[field.name][row_count:row_count + len(rows)], type=field.type)
+                                          if isinstance(columns[field.name], list)
+                                          else columns[field.name].slice(row_count, len(rows)))
+                        else:
+                            arrays.append(pa.array([row[field.name] for row in rows], type=field.type))
+                    writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+                rows = []
+                try:
+                    for item, result in item_results:
+                        rows.append(self._result_row(item, result))
+                        if len(rows) >= self.row_group_size:
+                            write_row_group(rows)
+                            row_count += len(rows)
+                            rows = []
+                finally:
+                    # A run stopped early, for instance by its token budget, keeps the rows classified so far
+                    if rows:
+                        write_row_group(rows)
+                        row_count += len(rows)
+
+            logger.info(f"{row_count} results successfully written to {output_file_path}")
+        except BudgetExceeded:
+            logger.info(f"{row_count} results written to {output_file_path} before the budget stopped the run")
+            raise
+        except Exception as e:
+            logger.error(f"Error writing results to Parquet: {str(e)}")
+            raise
+
 file_handler = FileHandler()
\ No newline at end of file
@@ -0,0 +1,113 @@
+import json
+import re
+
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+
+def extract_json_object(text: str) -> dict:
+    if not isinstance(text, str):
+        raise ValueError("Response is not a string")
+
+    stripped = text.strip()
+    try:
+        result = json.loads(stripped)
+        if isinstance(result, dict):
+            return result
+    except json.JSONDecodeError:
+        pass
+
+    # Prefer the contents of code fences, then fall back to the whole text
+    candidates = [match.strip() for match in _FENCE_PATTERN.findall(stripped)] + [stripped]
+    for candidate in candidates:
+        for span in balanced_spans(candidate):
+            for attempt in (span, _TRAILING_COMMA_PATTERN.sub(r"\1", span)):
+                try:
+                    result = json.loads(attempt)
+                    if isinstance(result, dict):
+                        return result
+                except json.JSONDecodeError:
+                    continue
+
+    raise ValueError("No JSON object found in response")
+
+def balanced_spans(text: str, max_starts: int = 20):
+    # Yields the balanced {...} span opening at each '{' in turn, so stray braces in prose are skipped
+    start = text.find('{')
+    starts = 0
+    while start != -1 and starts < max_starts:
+        starts += 1
+        end = _matching_brace(text, start)
+        if end is not None:
+            yield text[start:end + 1]
+        start = text.find('{', start + 1)
+
+def _matching_brace(text: str, start: int):
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return index
+    return None
+
+class JsonObjectScanner:
+    # Follows a streamed response chunk by chunk and reports when the first complete top-level object has arrived
+    def __init__(self):
+        self.text = ''
+        self.result = None
+        self._position = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> bool:
+        self.text += chunk
+        for index in range(self._position, len(self.text)):
+            char = self.text[index]
+            if self._start is None:
+                if char == '{':
+                    self._start, self._depth = index, 1
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    span = self.text[self._start:index + 1]
+                    for attempt in (span, _TRAILING_COMMA_PATTERN.sub(r"\1", span)):
+                        try:
+                            result = json.loads(attempt)
+                        except json.JSONDecodeError:
+                            continue
+                        if isinstance(result, dict):
+                            self.result = result
+                            self._position = index + 1
+                            return True
+                    # A stray brace in prose, keep looking for the real object
+                    self._start = None
+        self._position = len(self.text)
+        return False
@@ -1,25 +1,92 @@
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import os
+import json
+import queue
+import atexit
+import threading
+import time
 from utils.config_loader import config
 
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record),
+            'logger': record.name,
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+class RateLimitFilter(logging.Filter):
+    # Token bucket per call site for DEBUG/INFO records, warnings and errors always pass
+    def __init__(self, rate, burst):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The queue stays in-process, so formatting is left to the listener thread
+        return record
+
+class _RoutingHandler(logging.Handler):
+    def __init__(self, handlers_by_logger):
+        super().__init__()
+        self.handlers_by_logger = handlers_by_logger
+
+    def handle(self, record):
+        for handler in self.handlers_by_logger.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
 class Logger:
+    COMPONENTS = ('pipeline', 'document_processor', 'embedding_manager', 'vector_store', 'classification_manager',
+                  'file_handler', 'shard_manager', 'stage_pipeline', 'retrieval_cache', 'reranker',
+                  'zero_shot_classifier', 'llms', 'base_agent', 'collection_catalog', 'lexical_index', 'token_budget')
+
     def __init__(self):
         self.log_dir = config.log_dir
         self.log_level = getattr(logging, config.get('log_level', 'INFO').upper())
         self.max_log_size = config.get('max_log_size', 5 * 1024 * 1024)  # 5 MB by default
         self.backup_count = config.get('log_backup_count', 3)
-        
+        self.json_format = config.get('log_format', 'text') == 'json'
+        self.async_logging = config.get('log_async', False)
+        self.rate_limit_filter = RateLimitFilter(config.get('log_rate_limit', 0), config.get('log_rate_burst', 50))
+        self.handlers_by_logger = {}
+
         os.makedirs(self.log_dir, exist_ok=True)
-        
+
         # Create main logger
         self.logger = logging.getLogger('main')
         self.logger.setLevel(self.log_level)
-        
+
         # Create formatters
-        file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        console_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        
+        file_formatter = self._formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        console_formatter = self._formatter('%(asctime)s - %(levelname)s - %(message)s')
+
         # File handler with rotation
         file_handler = RotatingFileHandler(
             os.path.join(self.log_dir, 'main.log'),
@@ -28,41 +95,64 @@ class Logger:
         )
         file_handler.setLevel(self.log_level)
         file_handler.setFormatter(file_formatter)
-        
+
         # Console handler
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.DEBUG)
         console_handler.setFormatter(console_formatter)
-        
+
         # Add handlers to main logger
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
-        
+        self._add_handlers(self.logger, [file_handler, console_handler])
+
         # Create component-specific loggers
-        self.create_component_logger('pipeline', self.log_level)
-        self.create_component_logger('document_processor', self.log_level)
-        self.create_component_logger('embedding_manager', self.log_level)
-        self.create_component_logger('vector_store', self.log_level)
-        self.create_component_logger('classification_manager', self.log_level)
-        self.create_component_logger('file_handler', self.log_level)
+        for name in self.COMPONENTS:
+            self.create_component_logger(name, self.log_level)
+
+        if self.async_logging:
+            self._start_listener()
+
+    def _formatter(self, fmt):
+        return JsonFormatter() if self.json_format else logging.Formatter(fmt)
 
     def create_component_logger(self, name, level):
         logger = logging.getLogger(name)
         logger.setLevel(level)
-        
+
         file_handler = RotatingFileHandler(
             os.path.join(self.log_dir, f'{name}.log'),
             maxBytes=self.max_log_size,
             backupCount=self.backup_count
         )
         file_handler.setLevel(level)
-        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        
-        logger.addHandler(file_handler)
+        file_handler.setFormatter(self._formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+        self._add_handlers(logger, [file_handler])
+
+    def _add_handlers(self, logger, handlers):
+        logger.addFilter(self.rate_limit_filter)
+        if self.async_logging:
+            # Handlers are attached to the listener in _start_listener, the caller only enqueues
+            self.handlers_by_logger[logger.name] = handlers
+        else:
+            for handler in handlers:
+                logger.addHandler(handler)
+
+    def _start_listener(self):
+        log_queue = queue.SimpleQueue()
+        queue_handler = _DeferredQueueHandler(log_queue)
+        for name in self.handlers_by_logger:
+            logging.getLogger(name).addHandler(queue_handler)
+        self.listener = QueueListener(log_queue, _RoutingHandler(self.handlers_by_logger))
+        self.listener.start()
+        atexit.register(self.listener.stop)
 
     def get_logger(self, name='main'):
+        # Module names such as 'src.vector_store' map onto their component logger
+        component = name.rsplit('.', 1)[-1]
+        if component == 'main' or component in self.COMPONENTS:
+            return logging.getLogger(component)
         return logging.getLogger(name)
 
 # Create a global logger instance
 logger_instance = Logger()
-get_logger = logger_instance.get_logger
\ No newline at end of file
+get_logger = logger_instance.get_logger